@@ -2,11 +2,12 @@
 Applies a pre-learned RBIG transform to a dataset
 """
 
-import numpy as np
-from scipy.interpolate import interp1d
-from scipy.stats import norm
+from compiled_rbig import compile_rbig
+from tabulated_rbig import tabulate_rbig
 
-def apply_rbig(data, transform_params):
+def apply_rbig(data, transform_params, n_jobs=None, executor=None,
+               dtype=None, out=None, work=None, inplace=False,
+               accuracy=None):
   """
   Given a dataset and the parameters of a learned RBIG transorm apply to data
 
@@ -15,8 +16,10 @@ def apply_rbig(data, transform_params):
   data : ndarray
       A 2D array giving an iid sample in each column. Number of rows is the
       number of components in each datapoint.
-  transform_params
-      Parameters of the forward transform. Should have toplevel keys of
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. Either a compiled transform (see
+      compiled_rbig.py), an RBIGModel as returned by rbig(), or a dictionary
+      with toplevel keys of
       'pdf_extension': The fraction by which to extend the support of the
         gaussianized marginal pdf compared to the empirical marginal pdf
       'pdf_resolution': The number of points at which to compute the
@@ -27,35 +30,31 @@ def apply_rbig(data, transform_params):
           base level dictionary has keys
           'empirical_pdf_support', 'empirical_pdf', 'uniform_cdf_support',
           and 'uniform_cdf':
+  n_jobs : int, optional
+      If greater than 1, split the marginal stage of each iteration across
+      this many threads. See parallel_components.py
+  executor : concurrent.futures.Executor, optional
+      A (thread-based) executor to run the marginal stages on
+  dtype : data-type, optional
+      The dtype to transform the data in, e.g. np.float32. Default the dtype
+      of the model's rotations (see the dtype argument of rbig)
+  out : ndarray, optional
+      A preallocated array, of the same shape as the data and of the working
+      dtype, to write the result into
+  work : ndarray, optional
+      A second such array to use as scratch space. See CompiledRBIG.forward
+  inplace : bool, optional
+      Overwrite the input with the result. Default False
+  accuracy : float, optional
+      If given, use lookup tables that precompose each marginal stage into a
+      single interpolation, accurate to this many standard deviations per
+      stage. See tabulated_rbig.py. Default None, the exact transform
+
   Returns
   -------
   rbig_transformed : ndarray
       Same size as input, but gaussianized using the RBIG transform
   """
-  rbig_transformed = np.copy(data)
-  for rbig_iter in range(len(transform_params['iterations'])):
-    if rbig_iter % 10 == 0:
-      print("Completed ", rbig_iter, "iterations of RBIG on fresh data")
-    for component_idx in range(data.shape[0]):
-      # marginal uniformization
-      rbig_transformed[component_idx, :] = interp1d(
-          transform_params['iterations'][rbig_iter][
-            component_idx]['uniform_cdf_support'],
-          transform_params['iterations'][rbig_iter][
-            component_idx]['uniform_cdf'], fill_value='extrapolate')(
-          rbig_transformed[component_idx, :])
-      # marginal gaussianization
-      rbig_transformed[component_idx] = \
-          norm.ppf(rbig_transformed[component_idx, :])
-
-    # rotation
-    rbig_transformed = \
-        np.dot(transform_params['iterations'][rbig_iter]['rotation_matrix'],
-               rbig_transformed)
-
-  return rbig_transformed
-
-
-
-
-
+  transform = (compile_rbig(transform_params) if accuracy is None else
+               tabulate_rbig(transform_params, accuracy))
+  return transform.forward(data, n_jobs, executor, dtype, out, work, inplace)
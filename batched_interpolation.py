@@ -0,0 +1,160 @@
+"""
+This file defines row-wise (batched) versions of searchsorted and interp1d
+"""
+
+import numpy as np
+
+def batched_searchsorted(sorted_rows, values, side='left'):
+  """
+  Row-wise searchsorted for a stack of sorted arrays
+
+  Equivalent to calling np.searchsorted(sorted_rows[i], values[i], side) for
+  every row i, but done with a single stable sort over all the rows at once.
+
+  Parameters
+  ----------
+  sorted_rows : ndarray
+      A 2D array [DxK]. Each row must be sorted in increasing order
+  values : ndarray
+      A 2D array [DxM] of values to find insertion points for, row by row
+  side : str, optional
+      One of {'left', 'right'}, with the same meaning as in np.searchsorted
+
+  Returns
+  -------
+  indices : ndarray
+      A 2D integer array [DxM] of insertion indices into each row
+  """
+  num_sorted = sorted_rows.shape[1]
+  num_values = values.shape[1]
+  if side == 'left':
+    # ties are resolved by the stable sort in concatenation order, so putting
+    # the values first means equal sorted elements are *not* counted
+    combined = np.concatenate((values, sorted_rows), axis=1)
+    order = np.argsort(combined, axis=1, kind='stable')
+    is_sorted_elem = order >= num_values
+    value_offset = 0
+  elif side == 'right':
+    combined = np.concatenate((sorted_rows, values), axis=1)
+    order = np.argsort(combined, axis=1, kind='stable')
+    is_sorted_elem = order < num_sorted
+    value_offset = num_sorted
+  else:
+    raise ValueError('side ' + side + ' not recognized')
+  num_sorted_before = np.cumsum(is_sorted_elem, axis=1)
+  scattered = np.empty(combined.shape, dtype=np.intp)
+  np.put_along_axis(scattered, order, num_sorted_before, axis=1)
+  return scattered[:, value_offset:value_offset + num_values]
+
+
+def grid_searchsorted(grid_rows, values):
+  """
+  Row-wise left-sided searchsorted for evenly spaced rows
+
+  Because each row of grid_rows is a linspace, the insertion point can be
+  computed arithmetically instead of by sorting. The estimate is then
+  corrected against the actual grid values so that the result is exactly that
+  of np.searchsorted(grid_rows[i], values[i]).
+
+  Parameters
+  ----------
+  grid_rows : ndarray
+      A 2D array [DxK]. Each row must be evenly spaced and increasing
+  values : ndarray
+      A 2D array [DxM] of values to find insertion points for, row by row
+
+  Returns
+  -------
+  indices : ndarray
+      A 2D integer array [DxM] of insertion indices into each row
+  """
+  num_grid = grid_rows.shape[1]
+  grid_start = grid_rows[:, 0:1]
+  grid_step = (grid_rows[:, -1:] - grid_start) / (num_grid - 1)
+  estimate = np.floor((values - grid_start) / grid_step) + 1
+  # fmax/fmin (unlike clip) also send NaNs to a valid, if meaningless, index
+  np.fmin(np.fmax(estimate, 0, out=estimate), num_grid, out=estimate)
+  indices = estimate.astype(np.intp)
+  below = take_rows(grid_rows, np.maximum(indices - 1, 0))
+  indices -= (indices > 0) & (below >= values)
+  above = take_rows(grid_rows, np.minimum(indices, num_grid - 1))
+  indices += (indices < num_grid) & (above < values)
+  return indices
+
+
+def batched_interp1d(x, xp, fp):
+  """
+  Row-wise piecewise-linear interpolation, extrapolating past the end points
+
+  For points inside [xp[i, 0], xp[i, -1]] this gives exactly the same result as
+  interp1d(xp[i], fp[i])(x[i]). Points outside the range are linearly
+  extrapolated from the first/last segment, as with fill_value='extrapolate'.
+
+  Parameters
+  ----------
+  x : ndarray
+      A 2D array [DxM] giving the points at which to interpolate each row
+  xp : ndarray
+      A 2D array [DxK] giving the (strictly increasing) knots of each row
+  fp : ndarray
+      A 2D array [DxK] giving the function value at each of the knots
+
+  Returns
+  -------
+  interpolated : ndarray
+      A 2D array [DxM]
+  """
+  indices = batched_searchsorted(xp, x)
+  return interp_from_indices(x, xp, fp, indices)
+
+
+def interp_from_indices(x, xp, fp, indices):
+  """
+  Finishes a batched linear interpolation once the knot indices are known
+
+  Parameters
+  ----------
+  x : ndarray
+      A 2D array [DxM] giving the points at which to interpolate each row
+  xp : ndarray
+      A 2D array [DxK] giving the (strictly increasing) knots of each row
+  fp : ndarray
+      A 2D array [DxK] giving the function value at each of the knots
+  indices : ndarray
+      A 2D integer array [DxM]. The result of a left-sided searchsorted of x
+      into xp, row by row
+
+  Returns
+  -------
+  interpolated : ndarray
+      A 2D array [DxM]
+  """
+  num_knots = xp.shape[1]
+  # same order of operations as scipy's interp1d so results agree bitwise
+  slopes = np.diff(fp, axis=1) / np.diff(xp, axis=1)
+  segment = np.clip(indices, 1, num_knots - 1) - 1
+  x_lo = take_rows(xp, segment)
+  y_lo = take_rows(fp, segment)
+  return take_rows(slopes, segment) * (x - x_lo) + y_lo
+
+
+def take_rows(table, indices):
+  """
+  Row-wise gather, table[i, indices[i, j]] for each i and j
+
+  Much faster than np.take_along_axis because it indexes the flattened table.
+
+  Parameters
+  ----------
+  table : ndarray
+      A 2D array [DxK]
+  indices : ndarray
+      A 2D integer array [DxM], each entry in [0, K)
+
+  Returns
+  -------
+  gathered : ndarray
+      A 2D array [DxM]
+  """
+  row_offsets = table.shape[1] * np.arange(table.shape[0], dtype=np.intp)
+  return np.take(table.ravel(), indices + row_offsets[:, None])
@@ -0,0 +1,210 @@
+"""
+Benchmarks fitting, applying, inverting and density estimation with RBIG
+
+Times rbig, compiling the learned model, apply_rbig, invert_rbig and
+rbig_log_prob over a grid of dimensionalities, sample counts, iteration
+counts, pdf resolutions and rotation types, recording the wall time and peak
+memory of each. Peak memory is measured with tracemalloc, which sees numpy's
+array allocations, and is reported relative to what was allocated when the
+call started. Tracing slows down every allocation, so it is measured in a
+second, untimed call.
+
+Run headless from the command line, for instance
+
+  python benchmark_rbig.py --dims 2 10 --num-samples 10000 100000 \\
+      --num-iters 20 --rotation-types PCA householder --output results.json
+
+The results are written as JSON or, if the output file ends in .csv, as CSV.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+from rbig import rbig
+from apply_rbig import apply_rbig
+from invert_rbig import invert_rbig
+from estimate_prob_with_rbig import rbig_log_prob
+from compiled_rbig import CompiledRBIG, compile_rbig
+
+STAGES = ('fit', 'compile', 'apply', 'invert', 'log_prob')
+RESULT_FIELDS = ('stage', 'num_components', 'num_samples', 'num_iters',
+                 'pdf_resolution', 'rotation_type', 'repeat', 'wall_time',
+                 'peak_memory_bytes')
+
+def make_benchmark_data(num_components, num_samples, seed=0):
+  """
+  Generates a reproducible non-gaussian dataset for benchmarking
+
+  Half of the components are skewed (exponential of a gaussian) and the other
+  half are nonlinear functions of the first, so the data has both marginal
+  non-gaussianity and dependencies for RBIG to remove.
+
+  Returns
+  -------
+  data : ndarray
+      A 2D array [num_components x num_samples]
+  """
+  rng = np.random.default_rng(seed)
+  data = rng.standard_normal((num_components, num_samples))
+  num_skewed = (num_components + 1) // 2
+  data[:num_skewed] = np.exp(0.5 * data[:num_skewed])
+  data[num_skewed:] += np.sin(2 * data[:num_components - num_skewed])
+  return data
+
+
+def measure(func, *args, **kwargs):
+  """
+  Calls func twice, once to time it and once to track the memory it allocates
+
+  Returns
+  -------
+  result : object
+      What the timed call of func returned
+  wall_time : float
+      Elapsed wall-clock time in seconds of the first call
+  peak_memory_bytes : int
+      The peak of memory allocated during the second call, above what was
+      allocated when it started
+  """
+  start_time = time.perf_counter()
+  result = func(*args, **kwargs)
+  wall_time = time.perf_counter() - start_time
+
+  tracemalloc.start()
+  try:
+    baseline, _ = tracemalloc.get_traced_memory()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return result, wall_time, peak - baseline
+
+
+def run_benchmarks(dims, sample_counts, iteration_counts, pdf_resolutions,
+                   rotation_types, stages=STAGES, num_repeats=1, seed=0,
+                   report=print):
+  """
+  Runs every requested stage for every combination of settings
+
+  Parameters
+  ----------
+  dims, sample_counts, iteration_counts, pdf_resolutions : list of int
+      The values of D, N, the number of RBIG iterations, and pdf_resolution
+      to benchmark
+  rotation_types : list of str
+      The rotation types to benchmark. See rbig.py
+  stages : tuple of str, optional
+      Which of 'fit', 'compile', 'apply', 'invert', 'log_prob' to time. The
+      model is always fit, since the other stages need it, but only timed
+      (which fits it twice, see measure) if 'fit' is requested. 'compile'
+      is the one-time preparation of a model for the other stages (see
+      compiled_rbig.py), which is done before them, so that they measure
+      only the transforms. Default all of them
+  num_repeats : int, optional
+      How many times to repeat each measurement. Default 1
+  seed : int, optional
+      Seed for the benchmark data and the random rotations. Default 0
+  report : callable or None, optional
+      Called with each result as it is measured, e.g. to show progress.
+      Default print
+
+  Returns
+  -------
+  results : list of dictionaries
+      One per measurement, with the keys in RESULT_FIELDS
+  """
+  results = []
+  for (num_components, num_samples, num_iters, pdf_resolution,
+       rotation_type) in itertools.product(dims, sample_counts,
+                                           iteration_counts, pdf_resolutions,
+                                           rotation_types):
+    data = make_benchmark_data(num_components, num_samples, seed)
+    settings = {'num_components': num_components, 'num_samples': num_samples,
+                'num_iters': num_iters, 'pdf_resolution': pdf_resolution,
+                'rotation_type': rotation_type}
+    for repeat in range(num_repeats):
+      np.random.seed(seed + repeat)
+      timings = {}
+      if 'fit' in stages:
+        (g_data, model), *timings['fit'] = measure(
+            rbig, data, num_iters, rotation_type,
+            pdf_resolution=pdf_resolution)
+      else:
+        g_data, model = rbig(data, num_iters, rotation_type,
+                             pdf_resolution=pdf_resolution)
+      if 'compile' in stages:
+        _, *timings['compile'] = measure(CompiledRBIG, model)
+      compiled = compile_rbig(model)
+      if 'apply' in stages:
+        _, *timings['apply'] = measure(apply_rbig, data, compiled)
+      if 'invert' in stages:
+        _, *timings['invert'] = measure(invert_rbig, g_data, compiled)
+      if 'log_prob' in stages:
+        _, *timings['log_prob'] = measure(rbig_log_prob, data, compiled)
+
+      for stage in STAGES:
+        if stage in stages:
+          result = dict(settings, stage=stage, repeat=repeat,
+                        wall_time=timings[stage][0],
+                        peak_memory_bytes=timings[stage][1])
+          results.append(result)
+          if report is not None:
+            report(result)
+  return results
+
+
+def write_results(results, path):
+  """
+  Writes benchmark results to a JSON file or, if path ends in .csv, a CSV file
+
+  The JSON file also records the versions of python and numpy used.
+  """
+  if path.endswith('.csv'):
+    with open(path, 'w', newline='') as results_file:
+      writer = csv.DictWriter(results_file, fieldnames=RESULT_FIELDS)
+      writer.writeheader()
+      writer.writerows(results)
+  else:
+    with open(path, 'w') as results_file:
+      json.dump({'python_version': platform.python_version(),
+                 'numpy_version': np.__version__,
+                 'results': results}, results_file, indent=2)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--dims', type=int, nargs='+', default=[2, 10])
+  parser.add_argument('--num-samples', type=int, nargs='+',
+                      default=[10000, 100000])
+  parser.add_argument('--num-iters', type=int, nargs='+', default=[10])
+  parser.add_argument('--pdf-resolutions', type=int, nargs='+',
+                      default=[1000])
+  parser.add_argument('--rotation-types', nargs='+', default=['PCA'])
+  parser.add_argument('--stages', nargs='+', choices=STAGES,
+                      default=list(STAGES))
+  parser.add_argument('--repeats', type=int, default=1)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--output', default='rbig_benchmarks.json',
+                      help='where to write the results, .json or .csv')
+  args = parser.parse_args(argv)
+
+  def report(result):
+    print('{stage:>8} D={num_components} N={num_samples} '
+          'iters={num_iters} resolution={pdf_resolution} '
+          '{rotation_type}: {wall_time:.3f}s, '
+          '{peak_memory_bytes} bytes'.format(**result))
+
+  results = run_benchmarks(args.dims, args.num_samples, args.num_iters,
+                           args.pdf_resolutions, args.rotation_types,
+                           tuple(args.stages), args.repeats, args.seed,
+                           report)
+  write_results(results, args.output)
+
+
+if __name__ == '__main__':
+  main()
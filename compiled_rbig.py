@@ -0,0 +1,467 @@
+"""
+This file defines a compiled form of the RBIG transform for repeated application
+
+apply_rbig used to build a fresh interp1d for every (iteration, component) pair
+each time it was called. Everything that depends only on the transform
+parameters (the segment slopes of the piecewise-linear marginal CDFs) is
+computed once here, and the transform is then applied to all of the components
+of an iteration at once. Since the CDF support of every component is evenly
+spaced, locating each point's segment is arithmetic rather than a search.
+"""
+
+import logging
+import numpy as np
+from scipy.special import ndtr, ndtri
+from batched_interpolation import grid_searchsorted, take_rows
+from rbig_model import as_rbig_model
+from parallel_components import component_executor, run_component_blocks
+
+logger = logging.getLogger('rbig')
+
+MARGINAL_CHUNK_ELEMENTS = 2**16
+#^ the marginal stages work through this many entries of the data at a time
+
+class CompiledRBIG(object):
+  """
+  An RBIG transform prepared for fast, repeated application
+
+  Parameters
+  ----------
+  model : RBIGModel
+      The learned RBIG transform
+  uniform_cdf_slopes : ndarray, optional
+      The [IxDx(P-1)] slopes of the CDF segments, if already computed (for
+      instance memory-mapped from a saved model, see rbig_io.py)
+  """
+  def __init__(self, model, uniform_cdf_slopes=None):
+    self.model = model
+    if uniform_cdf_slopes is None:
+      uniform_cdf_slopes = (np.diff(model.uniform_cdf, axis=2) /
+                            np.diff(model.uniform_cdf_support, axis=2))
+      #^ same arithmetic as interp1d so that results match apply_rbig exactly
+    self.uniform_cdf_slopes = uniform_cdf_slopes
+
+  def marginal_uniformization(self, rbig_iter, data, components=slice(None),
+                              return_slopes=False):
+    """
+    Applies the marginal uniformization of one iteration to all components
+
+    Equivalent to interp1d(uniform_cdf_support, uniform_cdf,
+    fill_value='extrapolate') on each row of data.
+
+    Parameters
+    ----------
+    rbig_iter : int
+        The iteration whose marginal transform to apply
+    data : ndarray
+        A 2D array [DxN]
+    components : slice, optional
+        The components that the rows of data correspond to. Default all
+    return_slopes : bool, optional
+        Also return the derivative of the uniformization at each point, which
+        is the slope of the CDF segment the point falls in. Default False
+
+    Returns
+    -------
+    uniform_data : ndarray
+        A 2D array [DxN]
+    slopes : ndarray
+        A 2D array [DxN]. Only returned if return_slopes is True
+    """
+    support = self.model.uniform_cdf_support[rbig_iter, components]
+    segment = grid_searchsorted(support, data)
+    np.clip(segment, 1, support.shape[1] - 1, out=segment)
+    segment -= 1
+    slopes = take_rows(self.uniform_cdf_slopes[rbig_iter, components], segment)
+    uniform_data = (slopes * (data - take_rows(support, segment)) +
+                    take_rows(self.model.uniform_cdf[rbig_iter, components],
+                              segment))
+    if return_slopes:
+      return uniform_data, slopes
+    return uniform_data
+
+  def forward(self, data, n_jobs=None, executor=None, dtype=None, out=None,
+              work=None, inplace=False):
+    """
+    Applies the full RBIG transform
+
+    The marginal stage of each iteration is done in place, a block of columns
+    at a time so that its temporaries stay small, and the rotation writes into
+    a second buffer. Apart from those two buffers, nothing the size of the data
+    is allocated.
+
+    Parameters
+    ----------
+    data : ndarray
+        A 2D array giving an iid sample in each column
+    n_jobs : int, optional
+        If greater than 1, split the marginal stage of each iteration across
+        this many threads. See parallel_components.py
+    executor : concurrent.futures.Executor, optional
+        A (thread-based) executor to run the marginal stages on
+    dtype : data-type, optional
+        The dtype to transform the data in. The marginal transforms are
+        evaluated in float64 and cast back to it. Default the model's dtype
+    out : ndarray, optional
+        A preallocated [DxN] array of the working dtype to write the result
+        into
+    work : ndarray, optional
+        A second preallocated [DxN] array of the working dtype to use as
+        scratch space. Each iteration ping-pongs between the two buffers, so
+        when both out and work are given no [DxN] arrays are allocated at all
+    inplace : bool, optional
+        Write the result over the input, which must then already be in the
+        working dtype. Default False
+
+    Returns
+    -------
+    rbig_transformed : ndarray
+        Same size as input, but gaussianized using the RBIG transform
+    """
+    data = np.asarray(data)
+    num_iters = self.model.num_iters
+    result, scratch = _transform_buffers(
+        data, self.model.dtype if dtype is None else dtype, out, work, inplace)
+    # start in whichever buffer makes the last rotation land in result
+    current, other = (result, scratch) if num_iters % 2 == 0 else \
+        (scratch, result)
+    source = data
+    if data.dtype != result.dtype:
+      # round the input to the working dtype first, as rbig() does
+      np.copyto(current, data)
+      source = current
+    with component_executor(n_jobs, executor) as pool:
+      for rbig_iter in range(num_iters):
+        self._marginal_gaussianization(rbig_iter, source, current, pool,
+                                       n_jobs)
+        self.model.rotate(rbig_iter, current, out=other)
+        source, current, other = other, other, current
+    if num_iters == 0 and result is not data:
+      np.copyto(result, data)
+    return result
+
+  def _marginal_gaussianization(self, rbig_iter, data, out, executor, n_jobs):
+    """Uniformization then the gaussian quantile, written into out"""
+    def gaussianize_block(rows):
+      self._gaussianize_rows(rbig_iter, data, out, rows)
+
+    run_component_blocks(gaussianize_block, data.shape[0], executor, n_jobs)
+
+  def _gaussianize_rows(self, rbig_iter, data, out, rows):
+    """
+    The marginal stage for a block of rows, a block of columns at a time
+
+    out may be data itself. Apart from the small per-chunk temporaries,
+    nothing is allocated.
+    """
+    for cols in _column_chunks(data.shape[1], rows, data.shape[0]):
+      uniform_data = self._uniformize_for_dtype(
+          rbig_iter, data[rows, cols], rows, out.dtype)
+      ndtri(uniform_data, out=out[rows, cols])
+
+  def _update_slopes(self, rbig_iter, components=slice(None)):
+    """
+    Recomputes the CDF slopes of one iteration from the model
+
+    For a model that is still being fit, whose parameters are filled in one
+    iteration at a time.
+    """
+    self.uniform_cdf_slopes[rbig_iter, components] = (
+        np.diff(self.model.uniform_cdf[rbig_iter, components], axis=1) /
+        np.diff(self.model.uniform_cdf_support[rbig_iter, components], axis=1))
+
+  def _uniformize_for_dtype(self, rbig_iter, data, components, dtype):
+    """
+    The marginal uniformization, kept inside the CDFs' range in low precision
+
+    Rounding in reduced precision can push the most extreme samples just
+    past the support of a CDF, where extrapolation would give values outside
+    (0, 1) and an infinite or nan quantile. For a dtype less than float64
+    such values are replaced by the smallest or largest CDF value strictly
+    inside (0, 1).
+    """
+    uniform_data = self.marginal_uniformization(rbig_iter, data, components)
+    if dtype != np.float64:
+      self._clamp_to_cdf_range(rbig_iter, uniform_data, components)
+    return uniform_data
+
+  def _clamp_to_cdf_range(self, rbig_iter, uniform_data, components):
+    """Replaces values outside (0, 1) by the nearest CDF value inside it"""
+    cdf = self.model.uniform_cdf[rbig_iter, components]
+    np.copyto(uniform_data, cdf[:, 1:2], where=uniform_data <= 0)
+    np.copyto(uniform_data, cdf[:, -2:-1], where=uniform_data >= 1)
+
+  def marginal_inverse_uniformization(self, rbig_iter, uniform_data,
+                                      components=slice(None)):
+    """
+    Undoes the marginal uniformization of one iteration on all components
+
+    Equivalent to interp1d(uniform_cdf, uniform_cdf_support) on each row of
+    uniform_data. The CDF values are not evenly spaced, so unlike the forward
+    direction each row needs a binary search, which np.interp does without
+    building an interpolator object.
+
+    Parameters
+    ----------
+    rbig_iter : int
+        The iteration whose marginal transform to undo
+    uniform_data : ndarray
+        A 2D array [DxN] of values in [0, 1]
+    components : slice, optional
+        The components that the rows of uniform_data correspond to. Default
+        all
+
+    Returns
+    -------
+    data : ndarray
+        A 2D array [DxN]
+    """
+    cdf = self.model.uniform_cdf[rbig_iter, components]
+    support = self.model.uniform_cdf_support[rbig_iter, components]
+    data = np.empty(uniform_data.shape)
+    for row_idx in range(cdf.shape[0]):
+      data[row_idx] = np.interp(uniform_data[row_idx], cdf[row_idx],
+                                support[row_idx])
+    return data
+
+  def inverse(self, gaussian_data, n_jobs=None, executor=None,
+              progress_report_interval=None, dtype=None, out=None, work=None,
+              inplace=False):
+    """
+    Inverts the full RBIG transform
+
+    Like forward, this ping-pongs between two buffers and works through the
+    marginal stages a block of columns at a time.
+
+    Parameters
+    ----------
+    gaussian_data : ndarray
+        A 2D array giving an iid sample in each column, in the gaussianized
+        space
+    n_jobs : int, optional
+        If greater than 1, split the marginal stage of each iteration across
+        this many threads. See parallel_components.py
+    executor : concurrent.futures.Executor, optional
+        A (thread-based) executor to run the marginal stages on
+    progress_report_interval : int, optional
+        If specified, log the RBIG iteration number every
+        progress_report_interval iterations, at INFO level on the 'rbig'
+        logger.
+    dtype : data-type, optional
+        The dtype to transform the data in. The marginal transforms are
+        evaluated in float64 and cast back to it. Default the model's dtype
+    out : ndarray, optional
+        A preallocated [DxN] array of the working dtype to write the result
+        into
+    work : ndarray, optional
+        A second preallocated [DxN] array of the working dtype to use as
+        scratch space. Each iteration ping-pongs between the two buffers, so
+        when both out and work are given no [DxN] arrays are allocated at all
+    inplace : bool, optional
+        Write the result over the input, which must then already be in the
+        working dtype. Default False
+
+    Returns
+    -------
+    sampled_data : ndarray
+        gaussian_data mapped back into the input space
+    """
+    gaussian_data = np.asarray(gaussian_data)
+    num_iters = self.model.num_iters
+    result, scratch = _transform_buffers(
+        gaussian_data, self.model.dtype if dtype is None else dtype, out, work,
+        inplace)
+    # start in whichever buffer makes the last iteration land in result,
+    # unless that would rotate the input onto itself
+    current, other = (result, scratch) if num_iters % 2 == 1 else \
+        (scratch, result)
+    if current is gaussian_data:
+      current, other = other, current
+    source = gaussian_data
+    if gaussian_data.dtype != result.dtype:
+      np.copyto(other, gaussian_data)
+      source = other
+    with component_executor(n_jobs, executor) as pool:
+      for rbig_iter in range(num_iters-1, -1, -1):
+        if progress_report_interval is not None:
+          if rbig_iter % progress_report_interval == 0:
+            logger.info('Completed %d iterations of Inverse-RBIG',
+                        self.model.num_iters - rbig_iter)
+        # we have to go in reverse order
+        self.model.inverse_rotate(rbig_iter, source, out=current)
+        self._marginal_degaussianization(rbig_iter, current, current, pool,
+                                         n_jobs)
+        source, current, other = current, other, current
+    if source is not result:
+      np.copyto(result, source)
+    return result
+
+  def _marginal_degaussianization(self, rbig_iter, data, out, executor,
+                                  n_jobs):
+    """The gaussian cdf then the inverse uniformization, written into out"""
+    def degaussianize_block(rows):
+      for cols in _column_chunks(data.shape[1], rows, data.shape[0]):
+        # ndtr has a float32 loop, whose tails would be much coarser than the
+        # CDFs
+        out[rows, cols] = self.marginal_inverse_uniformization(
+            rbig_iter, ndtr(data[rows, cols].astype(np.float64, copy=False)),
+            rows)
+
+    run_component_blocks(degaussianize_block, data.shape[0], executor, n_jobs)
+
+  def sample(self, num_samples, rng=None, batch_size=None, n_jobs=None,
+             executor=None):
+    """
+    Draws new samples from the learned distribution
+
+    Standard normal draws are pushed through the inverse transform a batch at
+    a time. The draws for sample n are the n-th consecutive block of D values
+    from rng, so the samples for a given seed do not depend on batch_size or
+    on the number of workers.
+
+    Parameters
+    ----------
+    num_samples : int
+        The number of samples to draw
+    rng : int, np.random.Generator, or None, optional
+        Seed or generator passed to np.random.default_rng. Default None, fresh
+        unpredictable entropy
+    batch_size : int, optional
+        The number of samples to generate at a time, which bounds the working
+        memory. Default all of them at once
+    n_jobs : int, optional
+        If greater than 1, split the marginal stages across this many threads
+    executor : concurrent.futures.Executor, optional
+        A (thread-based) executor to run the marginal stages on
+
+    Returns
+    -------
+    samples : ndarray
+        A 2D array [D x num_samples], one sample per column, in the model's
+        dtype
+    """
+    rng = np.random.default_rng(rng)
+    num_components = self.model.num_components
+    if batch_size is None:
+      batch_size = max(1, num_samples)
+    samples = np.empty((num_components, num_samples), dtype=self.model.dtype)
+    batch = np.empty((num_components, min(batch_size, num_samples)),
+                     dtype=self.model.dtype)
+    work = np.empty_like(batch)
+    with component_executor(n_jobs, executor) as pool:
+      for base_idx in range(0, num_samples, batch_size):
+        this_batch_size = min(batch_size, num_samples - base_idx)
+        batch_view = batch[:, :this_batch_size]
+        batch_view[...] = rng.standard_normal(
+            (this_batch_size, num_components)).T
+        self.inverse(batch_view, n_jobs, pool, out=batch_view,
+                     work=work[:, :this_batch_size], inplace=True)
+        samples[:, base_idx:base_idx+this_batch_size] = batch_view
+    return samples
+
+  def log_prob(self, data):
+    """
+    Computes the log-density of data under the RBIG model
+
+    The rotations all have |det| = 1, so the log-determinant of the jacobian
+    of the full transform is just the sum, over iterations and components,
+    of the log-derivatives of the marginal transforms. The derivative of
+    x -> ndtri(F(x)) is F'(x) / phi(ndtri(F(x))), where F' is the slope of the
+    CDF segment x falls in and phi is the standard normal pdf. This costs
+    O(N*D) per iteration (plus the rotation) and, being done in log space, does
+    not underflow.
+
+    Parameters
+    ----------
+    data : ndarray
+        A 2D array giving an iid sample in each column
+
+    Returns
+    -------
+    log_prob : ndarray
+        A 1D array giving the log-density of each column of data. Points that
+        fall outside the support of any of the learned marginal CDFs have
+        zero density, i.e. a log-density of -inf. For a model in less than
+        float64, data is transformed in the model's dtype, and points that
+        rounding pushes just past a support are kept inside it, as in forward.
+    rbig_transformed : ndarray
+        data, gaussianized using the RBIG transform
+    """
+    num_components = data.shape[0]
+    half_log_2pi = 0.5 * np.log(2 * np.pi)
+    log_det_jacobian = np.zeros(data.shape[1])
+    outside_support = np.zeros(data.shape[1], dtype=bool)
+    # follow the same path through the model as forward does, in the model's
+    # dtype (see _uniformize_for_dtype)
+    dtype = self.model.dtype
+    rbig_transformed = data.astype(dtype, copy=False)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      for rbig_iter in range(self.model.num_iters):
+        uniform_data, slopes = self.marginal_uniformization(
+            rbig_iter, rbig_transformed, return_slopes=True)
+        if dtype != np.float64:
+          self._clamp_to_cdf_range(rbig_iter, uniform_data, slice(None))
+        outside_support |= np.any((uniform_data <= 0) | (uniform_data >= 1),
+                                  axis=0)
+        gaussian_data = ndtri(uniform_data)
+        # log F'(x) - log phi(g), with log phi(g) = -g**2/2 - log(2 pi)/2
+        log_det_jacobian += np.sum(np.log(slopes) + 0.5 * gaussian_data**2,
+                                   axis=0)
+        log_det_jacobian += num_components * half_log_2pi
+        rbig_transformed = self.model.rotate(
+            rbig_iter, gaussian_data.astype(dtype, copy=False))
+
+      log_prob = (log_det_jacobian -
+                  0.5 * np.sum(rbig_transformed**2, axis=0) -
+                  num_components * half_log_2pi)
+    log_prob[outside_support] = -np.inf
+    return log_prob, rbig_transformed
+
+
+def _transform_buffers(data, dtype, out, work, inplace):
+  """The result and scratch buffers for forward and inverse"""
+  dtype = np.dtype(dtype)
+  if inplace:
+    if data.dtype != dtype:
+      raise ValueError('inplace requires data of dtype ' + str(dtype) +
+                       ', not ' + str(data.dtype))
+    out = data
+  for buffer, name in ((out, 'out'), (work, 'work')):
+    if buffer is not None and (buffer.shape != data.shape or
+                               buffer.dtype != dtype):
+      raise ValueError(name + ' must have shape ' + str(data.shape) +
+                       ' and dtype ' + str(dtype))
+  if out is None:
+    out = np.empty(data.shape, dtype=dtype)
+  if work is None:
+    work = np.empty(data.shape, dtype=dtype)
+  return out, work
+
+
+def _column_chunks(num_columns, rows, num_rows):
+  """Slices of columns that keep the marginal stage's temporaries small"""
+  block_rows = len(range(*rows.indices(num_rows)))
+  chunk_size = max(1, MARGINAL_CHUNK_ELEMENTS // max(1, block_rows))
+  for base_idx in range(0, num_columns, chunk_size):
+    yield slice(base_idx, base_idx + chunk_size)
+
+
+def compile_rbig(transform_params):
+  """
+  Returns the compiled form of an RBIG transform
+
+  The compiled transform is cached on the model, so compiling the same model
+  again is free. A dictionary is converted to a fresh model on every call, so
+  convert it once with as_rbig_model if it will be applied repeatedly.
+
+  Parameters
+  ----------
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      The learned transform in any of its representations
+  """
+  if isinstance(transform_params, CompiledRBIG):
+    return transform_params
+  model = as_rbig_model(transform_params)
+  if model._compiled is None:
+    model._compiled = CompiledRBIG(model)
+  return model._compiled
@@ -1,24 +1,61 @@
 """
-This file defines a simple function for estimating data probability under rbig
+This file defines simple functions for estimating data probability under rbig
 """
-# WARNING: this has not been fully tested yet
+
+import numpy as np
+from compiled_rbig import compile_rbig
+from rbig_jacobian import rbig_jacobian
+
+def rbig_log_prob(original_data, transform_params):
+  """
+  Computes the log-probability of original data under the RBIG model
+
+  This is the preferred way to evaluate the density. Because each rotation
+  has |det| = 1 it never forms a jacobian matrix, accumulating the
+  log-derivatives of the marginal transforms instead. See
+  CompiledRBIG.log_prob in compiled_rbig.py.
+
+  Parameters
+  ----------
+  original_data : ndarray
+      Points at which the pdf is evaluated, one per column
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      paramters of the transformation. See apply_rbig.py
+
+  Returns
+  -------
+  log_prob_data_input_domain : ndarray
+      A 1D array giving the log-probability under the RBIG model of each
+      datapoint in the columns of original_data
+  gaussianized_data : ndarray
+      original_data mapped through the RBIG transform
+  """
+  return compile_rbig(transform_params).log_prob(original_data)
+
 
 def estimate_prob_with_rbig(original_data, transform_params,
-                            num_samples_jacobian=0):
+                            num_samples_jacobian=0, max_memory_bytes=None):
   """
   Computes the probability of original data under the generative RBIG model
 
+  This forms the full jacobian of the transform for every sample and takes
+  its determinant, which is expensive and can underflow in high dimensions.
+  If only the density is needed, use rbig_log_prob instead.
+
   Parameters
   ----------
   original_data : ndarray
       Points at which the pdf is evaluated
-  transform_params : dictionary
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
       paramters of the transformation. See invert_rbig.py for
       the structure this dictionary should have. This completely defines the
       generative model under RBIG
   num_samples_jacobian: int
       We might want to take several different estimates of the jacobian and
       average them together.
+  max_memory_bytes : int, optional
+      Working-memory budget for computing the jacobians, which sets how many
+      samples are processed at once. See rbig_jacobian.py
 
   Returns
   -------
@@ -37,44 +74,29 @@ def estimate_prob_with_rbig(original_data, transform_params,
   # not sure why we divide by 20...in the example script num_samples_jac is set
   # to 20 so maybe it's for a related reason...
   component_wise_std = np.std(original_data, axis=1) / 20
+  transform_params = compile_rbig(transform_params)
+  #^ compile once for all of the jacobian passes
 
-  num_components = original_data.shape[0]
   num_samples = original_data.shape[1]
-  chunk_size = 2000
-  #^ compute the jacobian for batches of samples that are this big
-  full_chunks = np.floor(num_samples, chunk_size)
-  leftover = np.mod(num_samples, chunk_size)
 
-  prob_data_gaussian_domain = np.zeros([num_samples_jacobian, num_samples])
-  prob_data_input_domain = np.zeros([num_samples_jacobian, num_samples])
+  prob_data_gaussian_domain = np.zeros([num_samples_jacobian + 1, num_samples])
+  prob_data_input_domain = np.zeros([num_samples_jacobian + 1, num_samples])
   for jac_iter in range(num_samples_jacobian + 1):
-    jacobians = np.zeros((num_samples, num_components, num_components))
-    #^ a jacobian for each sample
     # TODO: figure out what's going on here
     if jac_iter < num_samples_jacobian:
       data_aux = original_data + component_wise_std[:, None]
     else:
       data_aux = original_data
-    data_temp = np.zeros(data_aux.shape)
 
     # now compute the jacobian for each sample
-    for base_iter in range(0, full_chunks*jacobian_chunk_size,
-                           jacobian_chunk_size):
-      (jacobians[base_iter:base_iter+jacobian_chunk_size, :, :],
-       data_temp[:, base_iter:base_iter+jacobian_chunk_size]) = (
-         rbig_jacobian(data_aux[:, base_iter:base_iter+jacobian_chunk_size],
-                       transform_params))
-    # cleanup the leftover
-    if leftover > 0:
-      (jacobians[full_chunks*jacobian_chunk_size:, :, :],
-       data_temp[:, full_chunks*jacobian_chunk_size:]) = (
-         rbig_jacobian(data_aux[:, full_chunks*jacobian_chunk_size:],
-                       transform_params))
+    jacobians, data_temp = rbig_jacobian(
+        data_aux, transform_params, max_memory_bytes=max_memory_bytes)
+    #^ a jacobian for each sample
 
     det_jacobians = np.linalg.det(jacobians)
     #^ computes determinant for each sample's jacobian
     prob_data_gaussian_domain[jac_iter, :] = np.prod(
-        (1 / np.sqrt(2 * np.pi)) * np.exp(-0.5 * np.power(data_temp, 2))
+        (1 / np.sqrt(2 * np.pi)) * np.exp(-0.5 * np.power(data_temp, 2)),
         axis=0)
     #^ computes the total probability under the gaussian model for each datapoint
     prob_data_input_domain[jac_iter, :] = (
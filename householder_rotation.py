@@ -0,0 +1,117 @@
+"""
+This file defines cheap structured random rotations built from reflections
+
+A dense random rotation costs O(D^3) to draw, O(D^2) to store and O(D^2) per
+sample to apply. A product of k Householder reflections,
+Q = H_1 H_2 ... H_k with H_i = I - 2 v_i v_i^T, is also orthogonal but is
+stored as just the k unit vectors v_i. Using the compact WY representation
+Q = I - V T V^T (Schreiber & Van Loan 1989), where V is [Dxk] and T is a
+[kxk] upper triangular matrix, applying Q to data is two thin matrix products,
+O(kD) per sample.
+
+The price is weak mixing. Q leaves every vector orthogonal to all of the v_i
+unchanged, so each rotation only mixes the components within a random
+k-dimensional subspace, and for k much smaller than D it takes many iterations
+before every direction has been mixed with every other. The default k of
+ceil(log2(D)) + 1 keeps each iteration cheap, not well mixed: for large D,
+expect to need more iterations than with a dense rotation, or pass a larger
+num_reflections, up to k = D, which mixes every direction in each rotation.
+"""
+
+import numpy as np
+
+def default_num_reflections(num_components):
+  """The default number of reflections per rotation, ceil(log2(D)) + 1"""
+  return int(np.ceil(np.log2(num_components))) + 1
+
+
+def random_householder_vectors(num_components, num_reflections):
+  """
+  Draws the unit vectors of a random product of Householder reflections
+
+  Parameters
+  ----------
+  num_components : int
+      The dimensionality D of the data
+  num_reflections : int
+      The number k of reflections
+
+  Returns
+  -------
+  householder_vectors : ndarray
+      A 2D array [kxD], one unit vector per row
+  """
+  vectors = np.random.randn(num_reflections, num_components)
+  return vectors / np.linalg.norm(vectors, axis=1)[:, None]
+
+
+def householder_wy_factor(householder_vectors):
+  """
+  Computes T in the compact WY form Q = I - V T V^T of a reflection product
+
+  Parameters
+  ----------
+  householder_vectors : ndarray
+      A 2D array [kxD] of unit vectors, Q = H_1 H_2 ... H_k
+
+  Returns
+  -------
+  wy_factor : ndarray
+      A 2D upper triangular array [kxk], of the same dtype as the vectors
+  """
+  num_reflections = householder_vectors.shape[0]
+  gram = np.dot(householder_vectors, householder_vectors.T)
+  wy_factor = np.zeros((num_reflections, num_reflections))
+  for j in range(num_reflections):
+    # appending H_j = I - 2 v_j v_j^T to the product adds a column to T
+    wy_factor[:j, j] = -2 * np.dot(wy_factor[:j, :j], gram[:j, j])
+    wy_factor[j, j] = 2
+  return wy_factor.astype(householder_vectors.dtype, copy=False)
+
+
+def apply_householder(householder_vectors, wy_factor, data, transpose=False,
+                      out=None):
+  """
+  Multiplies data by the reflection product Q (or by its transpose)
+
+  Parameters
+  ----------
+  householder_vectors : ndarray
+      A 2D array [kxD] of unit vectors, Q = H_1 H_2 ... H_k
+  wy_factor : ndarray
+      The [kxk] factor returned by householder_wy_factor
+  data : ndarray
+      A 2D array [DxN]
+  transpose : bool, optional
+      If True compute Q^T data, which undoes the rotation. Default False
+  out : ndarray, optional
+      A [DxN] array, not overlapping data, to write the result into
+
+  Returns
+  -------
+  rotated_data : ndarray
+      A 2D array [DxN]
+  """
+  projections = np.dot(householder_vectors, data)
+  if transpose:
+    projections = np.dot(wy_factor.T, projections)
+  else:
+    projections = np.dot(wy_factor, projections)
+  rotated_data = np.matmul(householder_vectors.T, projections, out=out)
+  return np.subtract(data, rotated_data, out=rotated_data)
+
+
+def householder_to_matrix(householder_vectors):
+  """
+  Forms the dense [DxD] rotation matrix of a reflection product
+
+  Parameters
+  ----------
+  householder_vectors : ndarray
+      A 2D array [kxD] of unit vectors, Q = H_1 H_2 ... H_k
+  """
+  num_components = householder_vectors.shape[1]
+  return apply_householder(householder_vectors,
+                           householder_wy_factor(householder_vectors),
+                           np.eye(num_components,
+                                  dtype=householder_vectors.dtype))
@@ -0,0 +1,47 @@
+"""
+This file defines estimates of how much non-gaussianity each RBIG step removes
+
+In RBIG the rotations leave the (joint) negentropy of the data unchanged, and
+marginal gaussianization removes exactly the sum of the marginal negentropies
+(Laparra et al. 2011). So the sum of the marginal negentropies of the data
+going into an iteration is the reduction in total correlation achieved by that
+iteration, and once it stops dropping there is no point in iterating further.
+"""
+
+import numpy as np
+
+def marginal_negentropy(empirical_pdf, empirical_pdf_support, variance,
+                        n_samps):
+  """
+  Estimates the negentropy of each component from its histogram
+
+  The negentropy is the entropy of a gaussian with the same variance minus the
+  entropy of the component, which is zero for gaussian marginals and positive
+  otherwise. The entropy is the plug-in histogram estimate with the
+  Miller-Madow bias correction.
+
+  Parameters
+  ----------
+  empirical_pdf : ndarray
+      A 2D array [DxB] of empirical marginal pdfs, as returned in the params
+      of multivariate_make_normal (padded with a zero at each end)
+  empirical_pdf_support : ndarray
+      A 2D array [DxB] of the (evenly spaced) bin centers of those pdfs
+  variance : ndarray
+      A 1D array [D] giving the variance of each component
+  n_samps : int
+      The number of samples the histograms were computed from
+
+  Returns
+  -------
+  negentropy : ndarray
+      A 1D array [D] giving the estimated negentropy of each component, in nats
+  """
+  bin_size = empirical_pdf_support[:, 2] - empirical_pdf_support[:, 1]
+  bin_prob = empirical_pdf * bin_size[:, None]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    plogp = np.where(bin_prob > 0, bin_prob * np.log(bin_prob), 0.0)
+    entropy = (-np.sum(plogp, axis=1) + np.log(bin_size) +
+               (np.count_nonzero(bin_prob, axis=1) - 1) / (2 * n_samps))
+    gaussian_entropy = 0.5 * np.log(2 * np.pi * np.e * variance)
+  return gaussian_entropy - entropy
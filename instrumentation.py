@@ -0,0 +1,77 @@
+"""
+This file defines instrumentation of the RBIG iteration loop
+
+An IterationProfiler collects how long each stage of an iteration took
+(marginal gaussianization, the monotonic correction of the CDFs within it, and
+the rotation) and, if tracemalloc is tracing, the peak memory allocated during
+the iteration. rbig() hands these, along with its convergence metrics, to a
+user callback after every iteration, records the timings in the model's
+diagnostics, and reports progress through the 'rbig' logger rather than on
+stdout.
+"""
+
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+STAGE_NAMES = ('marginal', 'monotonic', 'rotation')
+
+class IterationProfiler(object):
+  """
+  Accumulates per-stage wall times and peak memory for one iteration
+
+  Stages may be timed from several worker threads at once, in which case
+  their times add up, so a stage run on a pool reports the total time spent
+  on it by all of the workers.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.start()
+
+  def start(self):
+    """Clears the timings and starts a new memory measurement window"""
+    self.stage_times = dict.fromkeys(STAGE_NAMES, 0.0)
+    if tracemalloc.is_tracing():
+      tracemalloc.reset_peak()
+      self._start_bytes = tracemalloc.get_traced_memory()[0]
+    else:
+      self._start_bytes = None
+
+  @contextmanager
+  def stage(self, name):
+    """Context manager adding the time spent inside it to the named stage"""
+    start_time = time.perf_counter()
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start_time
+      with self._lock:
+        self.stage_times[name] = self.stage_times.get(name, 0.0) + elapsed
+
+  def results(self):
+    """
+    The measurements since start() was called
+
+    Returns
+    -------
+    stats : dictionary
+        '<stage>_time' giving the seconds spent in each stage, and
+        'peak_bytes' giving the peak memory allocated above the level at the
+        start, or None if tracemalloc is not tracing
+    """
+    stats = {name + '_time': elapsed
+             for name, elapsed in self.stage_times.items()}
+    if self._start_bytes is not None and tracemalloc.is_tracing():
+      stats['peak_bytes'] = (tracemalloc.get_traced_memory()[1] -
+                             self._start_bytes)
+    else:
+      stats['peak_bytes'] = None
+    return stats
+
+
+def profile_stage(profiler, name):
+  """Times a stage on profiler, or does nothing if profiler is None"""
+  if profiler is None:
+    return nullcontext()
+  return profiler.stage(name)
@@ -2,10 +2,12 @@
 This file defines functionality to invert an RBIG transform
 """
 
-import numpy as np
-from univariate_invert_normalization import univariate_invert_normalization
+from compiled_rbig import compile_rbig
+from tabulated_rbig import tabulate_rbig
 
-def invert_rbig(gaussian_data, transform_params, progress_report_interval=None):
+def invert_rbig(gaussian_data, transform_params, progress_report_interval=None,
+                n_jobs=None, executor=None, dtype=None, out=None, work=None,
+                inplace=False, accuracy=None):
   """
   Inverts an RBIG transform by using the saved transform params
 
@@ -14,8 +16,10 @@ def invert_rbig(gaussian_data, transform_params, progress_report_interval=None):
   gaussian_data : ndarray
       A 2D array giving an iid sample in each column. The components within
       each column have been gaussianized by RBIG.
-  transform_params : dictionary
-      Parameters of the forward transform. Should have toplevel keys of
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. Either a compiled transform (see
+      compiled_rbig.py), an RBIGModel as returned by rbig(), or a dictionary
+      with toplevel keys of
       'pdf_extension': The fraction by which to extend the support of the
         gaussianized marginal pdf compared to the empirical marginal pdf
       'pdf_resolution': The number of points at which to compute the
@@ -27,28 +31,34 @@ def invert_rbig(gaussian_data, transform_params, progress_report_interval=None):
           'empirical_pdf_support', 'empirical_pdf', 'uniform_cdf_support',
           and 'uniform_cdf':
   progress_report_interval : int, optional
-      If specified, report the RBIG iteration number every
-      progress_report_interval iterations.
+      If specified, log the RBIG iteration number every
+      progress_report_interval iterations, at INFO level on the 'rbig' logger
+  n_jobs : int, optional
+      If greater than 1, split the marginal stage of each iteration across
+      this many threads. See parallel_components.py
+  executor : concurrent.futures.Executor, optional
+      A (thread-based) executor to run the marginal stages on
+  dtype : data-type, optional
+      The dtype to invert the data in, e.g. np.float32. Default the dtype of
+      the model's rotations (see the dtype argument of rbig)
+  out : ndarray, optional
+      A preallocated array, of the same shape as the data and of the working
+      dtype, to write the result into
+  work : ndarray, optional
+      A second such array to use as scratch space. See CompiledRBIG.inverse
+  inplace : bool, optional
+      Overwrite the input with the result. Default False
+  accuracy : float, optional
+      If given, use lookup tables that precompose each marginal stage into a
+      single interpolation, accurate to this many standard deviations per
+      stage. See tabulated_rbig.py. Default None, the exact transform
 
   Returns
   -------
   sampled_data : ndarray
       Data sampled under the inverse model
   """
-  sampled_data = np.copy(gaussian_data)
-  total_iters = 0
-  for rbig_iter in range(len(transform_params['iterations'])-1, -1, -1):
-    if progress_report_interval is not None:
-      if rbig_iter % progress_report_interval == 0:
-        print("Completed ", len(transform_params['iterations']) - rbig_iter,
-              "iterations of Inverse-RBIG")
-    # we have to go in reverse order
-    rotation_matrix = (transform_params['iterations'][rbig_iter]
-                                       ['rotation_matrix'])
-    sampled_data = np.dot(rotation_matrix.T, sampled_data)
-    for component_idx in range(sampled_data.shape[0]):
-      sampled_data[component_idx, :] = univariate_invert_normalization(
-          sampled_data[component_idx, :],
-          transform_params['iterations'][rbig_iter][component_idx])
-
-  return sampled_data
+  transform = (compile_rbig(transform_params) if accuracy is None else
+               tabulate_rbig(transform_params, accuracy))
+  return transform.inverse(gaussian_data, n_jobs, executor,
+                           progress_report_interval, dtype, out, work, inplace)
@@ -0,0 +1,304 @@
+"""
+This file defines marginal normalization of every component of a dataset at once
+
+This is the batched counterpart of univariate_make_normal.py. Rather than
+building a histogram, an interp1d, and a monotonic CDF for each row in turn,
+we do each of these steps for all of the rows with a single set of numpy
+operations. The per-component parameters are the same as those computed by
+univariate_make_normal, just stacked into 2D arrays with one row per component.
+"""
+
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import norm
+from batched_interpolation import (batched_interp1d, grid_searchsorted,
+                                   interp_from_indices, take_rows)
+from univariate_make_normal import (make_cdf_monotonic,
+                                    make_cdf_monotonic_vectorized)
+from instrumentation import profile_stage
+
+HISTOGRAM_CHUNK_ELEMENTS = 2**16
+#^ estimate_marginal_params bins this many entries of the data at a time
+
+def multivariate_make_normal(data, extension, precision,
+                             monotonic_method='laparra', profiler=None):
+  """
+  Transforms each component of data to have approximately normal marginal dist
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxS] giving an iid sample in each column, where D is the
+      number of components and S is the number of samples in the dataset
+  extension : float
+      Extend the marginal PDF support by this amount.
+  precision : int
+      The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDFs to be strictly increasing. See
+      make_cdf_monotonic in univariate_make_normal.py
+  profiler : IterationProfiler, optional
+      If given, the monotonic correction of the CDFs is timed on it. See
+      instrumentation.py
+
+  Returns
+  -------
+  gaussian_data : ndarray
+      A 2D array [DxS], each row marginally gaussianized
+  params : dictionary
+      parameters of the transform, with the same keys as in
+      univariate_make_normal but each entry stacked into a 2D array with one
+      row per component.
+  """
+  data_uniform, params = multivariate_make_uniform(data, extension, precision,
+                                                   monotonic_method, profiler)
+  return norm.ppf(data_uniform), params
+
+
+def multivariate_make_uniform(data, extension, precision,
+                              monotonic_method='laparra', profiler=None):
+  """
+  Transforms each component of data to have approximately uniform marginal dist
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxS] giving an iid sample in each column, where D is the
+      number of components and S is the number of samples in the dataset
+  extension : float
+      Extend the marginal PDF support by this amount. Default 0.1
+  precision : int
+      The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDFs to be strictly increasing. See
+      make_cdf_monotonic in univariate_make_normal.py
+  profiler : IterationProfiler, optional
+      If given, the monotonic correction of the CDFs is timed on it
+
+  Returns
+  -------
+  uniform_data : ndarray
+      A 2D array [DxS], each row marginally uniformized
+  transform_params : dictionary
+      parameters of the transform, stacked with one row per component
+  """
+  transform_params = estimate_marginal_params(data, extension, precision,
+                                              monotonic_method, profiler)
+  # the support is a linspace, so we can skip sorting when interpolating
+  support_idx = grid_searchsorted(transform_params['uniform_cdf_support'], data)
+  uniform_data = interp_from_indices(
+      data, transform_params['uniform_cdf_support'],
+      transform_params['uniform_cdf'], support_idx)
+
+  return uniform_data, transform_params
+
+
+def estimate_marginal_params(data, extension, precision,
+                             monotonic_method='laparra', profiler=None,
+                             support_min=None, support_max=None):
+  """
+  Learns the marginal uniformization of each component without applying it
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxS] giving an iid sample in each column
+  extension : float
+      Extend the marginal PDF support by this amount.
+  precision : int
+      The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDFs to be strictly increasing. See
+      make_cdf_monotonic in univariate_make_normal.py
+  profiler : IterationProfiler, optional
+      If given, the monotonic correction of the CDFs is timed on it
+  support_min, support_max : ndarray, optional
+      1D arrays [D]. If given, the support of each CDF is widened to cover
+      these values, e.g. the range of the full dataset when data is a
+      subsample of it. See uniform_cdf_from_histogram
+
+  Returns
+  -------
+  transform_params : dictionary
+      parameters of the transform, stacked with one row per component
+  """
+  n_samps = data.shape[1]
+  # the supports and CDFs are always float64, whatever the dtype of the data,
+  # since the monotonic correction works at the 1e-14 level
+  data_min = np.min(data, axis=1).astype(np.float64)
+  data_max = np.max(data, axis=1).astype(np.float64)
+  num_bins = int(np.sqrt(n_samps))
+  bin_edges = np.linspace(data_min, data_max, num_bins + 1, axis=1)
+  # a block of columns at a time, so that the bin indices stay small
+  counts = np.zeros((data.shape[0], num_bins), dtype=np.intp)
+  chunk_size = max(1, HISTOGRAM_CHUNK_ELEMENTS // max(1, data.shape[0]))
+  for base_idx in range(0, n_samps, chunk_size):
+    counts += batched_histogram(data[:, base_idx:base_idx + chunk_size],
+                                bin_edges)
+  return uniform_cdf_from_histogram(counts, bin_edges, n_samps, extension,
+                                    precision, monotonic_method, profiler,
+                                    support_min, support_max)
+
+
+def multivariate_apply_normal(data, transform_params, min_quantile=None):
+  """
+  Applies learned marginal gaussianizations to each component of data
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxS], one row per component
+  transform_params : dictionary
+      Stacked parameters as returned by multivariate_make_normal or
+      estimate_marginal_params
+  min_quantile : float, optional
+      If given, clip the uniformized data to [min_quantile, 1 - min_quantile]
+      before taking the gaussian quantile. Points beyond the support of the
+      learned CDFs would otherwise extrapolate past 0 or 1 and become
+      infinite or nan, which can happen when the parameters were learned from
+      a subsample of data.
+
+  Returns
+  -------
+  gaussian_data : ndarray
+      A 2D array [DxS], each row marginally gaussianized
+  """
+  support = transform_params['uniform_cdf_support']
+  uniform_data = interp_from_indices(data, support,
+                                     transform_params['uniform_cdf'],
+                                     grid_searchsorted(support, data))
+  if min_quantile is not None:
+    np.clip(uniform_data, min_quantile, 1 - min_quantile, out=uniform_data)
+  return ndtri(uniform_data)
+
+
+def batched_histogram(data, bin_edges):
+  """
+  Counts the samples of each row of data falling in that row's bins
+
+  Gives the same counts as np.histogram(data[i], bin_edges[i]) for each row,
+  i.e. bins are closed on the left and the last bin is also closed on the
+  right. The edges of each row are assumed to be evenly spaced.
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxS]
+  bin_edges : ndarray
+      A 2D array [Dx(B+1)] of evenly spaced bin edges for each row
+
+  Returns
+  -------
+  counts : ndarray
+      A 2D integer array [DxB]
+  """
+  num_rows = data.shape[0]
+  num_bins = bin_edges.shape[1] - 1
+  first_edge = bin_edges[:, 0:1]
+  bin_span = bin_edges[:, -1:] - first_edge
+  with np.errstate(divide='ignore', invalid='ignore'):
+    scale = np.where(bin_span > 0, num_bins / bin_span, 0.0)
+  bin_idx = ((data - first_edge) * scale).astype(np.intp)
+  np.clip(bin_idx, 0, num_bins - 1, out=bin_idx)
+  # the arithmetic above can be off by one right at an edge, so correct against
+  # the actual edge values like np.histogram does
+  bin_idx -= data < take_rows(bin_edges, bin_idx)
+  bin_idx += ((data >= take_rows(bin_edges, bin_idx + 1)) &
+              (bin_idx != num_bins - 1))
+  flat_idx = bin_idx + num_bins * np.arange(num_rows)[:, None]
+  return np.bincount(flat_idx.ravel(),
+                     minlength=num_rows * num_bins).reshape(num_rows, num_bins)
+
+
+def uniform_cdf_from_histogram(counts, bin_edges, n_samps, extension,
+                               precision, monotonic_method='laparra',
+                               profiler=None, support_min=None,
+                               support_max=None):
+  """
+  Builds the stacked marginal uniformization parameters from histograms
+
+  This mirrors the construction in univariate_make_uniform, one row per
+  component.
+
+  Parameters
+  ----------
+  counts : ndarray
+      A 2D array [DxB] of histogram counts for each component
+  bin_edges : ndarray
+      A 2D array [Dx(B+1)] of evenly spaced bin edges for each component
+  n_samps : int
+      The number of samples that the histograms were computed from
+  extension : float
+      Extend the marginal PDF support by this amount.
+  precision : int
+      The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDFs to be strictly increasing. See
+      make_cdf_monotonic in univariate_make_normal.py
+  profiler : IterationProfiler, optional
+      If given, the monotonic correction of the CDFs is timed on it
+  support_min, support_max : ndarray, optional
+      1D arrays [D]. If given, the outer ends of each CDF's support are moved
+      out (if need be) so that these values fall well inside it, where the
+      CDF is strictly between 0 and 1. Below the histogram's first edge the
+      CDF falls linearly to 0, and above its last edge it rises linearly to 1,
+      just as over the usual extension.
+
+  Returns
+  -------
+  transform_params : dictionary
+      parameters of the transform, stacked with one row per component
+  """
+  num_rows = counts.shape[0]
+  data_min = bin_edges[:, 0]
+  data_max = bin_edges[:, -1]
+  support_extension = (extension / 100) * np.abs(data_max - data_min)
+
+  bin_centers = (bin_edges[:, :-1] + bin_edges[:, 1:]) / 2
+  bin_size = bin_edges[:, 2:3] - bin_edges[:, 1:2]
+  pdf_support = np.hstack((bin_centers[:, :1] - bin_size, bin_centers,
+                           bin_centers[:, -1:] + bin_size))
+  zero_col = np.zeros((num_rows, 1))
+  empirical_pdf = np.hstack(
+      (zero_col, counts / (np.sum(counts, axis=1)[:, None] * bin_size),
+       zero_col))
+  #^ this is unnormalized
+  c_sum = np.cumsum(counts, axis=1)
+  cdf = (1 - 1 / n_samps) * c_sum / n_samps
+
+  incr_bin = bin_size / 2
+
+  # values beyond the histogram are placed halfway out along the stretch
+  # where the CDF goes to 0 or 1, so that they keep at least 1/(2 n_samps) of
+  # probability beyond them. Any closer to 0 or 1 and the gaussian quantile
+  # could not be inverted accurately
+  support_start = data_min
+  support_end = data_max
+  if support_min is not None:
+    support_start = data_min - 2 * np.maximum(data_min - support_min, 0)
+  if support_max is not None:
+    support_end = data_max + 2 * np.maximum(support_max - data_max, 0)
+  new_bin_edges = np.hstack(((support_start - support_extension)[:, None],
+                             data_min[:, None],
+                             bin_centers + incr_bin,
+                             (support_end + support_extension)[:, None] +
+                             incr_bin))
+  extended_cdf = np.hstack((zero_col, np.full((num_rows, 1), 1.0 / n_samps),
+                            cdf, np.ones((num_rows, 1))))
+  new_support = np.linspace(new_bin_edges[:, 0], new_bin_edges[:, -1],
+                            precision, axis=1)
+  uniform_cdf = batched_interp1d(new_support, new_bin_edges, extended_cdf)
+  #^ linear interpolation
+  with profile_stage(profiler, 'monotonic'):
+    if monotonic_method == 'vectorized':
+      uniform_cdf = make_cdf_monotonic_vectorized(uniform_cdf)
+    else:
+      for c_idx in range(num_rows):
+        uniform_cdf[c_idx] = make_cdf_monotonic(uniform_cdf[c_idx],
+                                                monotonic_method)
+  uniform_cdf /= np.max(uniform_cdf, axis=1)[:, None]
+
+  return {'empirical_pdf_support': pdf_support,
+          'empirical_pdf': empirical_pdf,
+          'uniform_cdf_support': new_support,
+          'uniform_cdf': uniform_cdf}
@@ -0,0 +1,208 @@
+"""
+This file defines a pass that prunes a learned RBIG transform for inference
+
+Late in fitting, the marginal gaussianization of an iteration is often very
+close to the identity, since the data going into it is already nearly
+gaussian, yet applying the iteration still costs its marginal transforms and
+a full rotation. When the marginal stage of iteration t is (close to) the
+identity, iteration t-1's rotation is followed directly by iteration t's, so
+the two can be folded into a single matrix R_t R_{t-1}. Doing this for every
+near-identity stage gives a shorter model that computes almost the same
+transform.
+"""
+
+import numpy as np
+from scipy.special import ndtri
+from compiled_rbig import CompiledRBIG, compile_rbig
+from rbig_model import RBIGModel, MARGINAL_PARAM_NAMES, as_rbig_model
+
+def optimize_rbig_model(transform_params, tol=None, tail_probability=1e-3,
+                        validation_data=None):
+  """
+  Drops near-identity marginal stages and folds the adjacent rotations
+
+  Parameters
+  ----------
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      The learned transform to optimize. It is not modified.
+  tol : float, optional
+      An iteration's marginal stage is dropped if, for every component, the
+      gaussianizing map x -> ndtri(F(x)) is within tol of x at all of the
+      points where its CDF is tabulated with
+      tail_probability <= F(x) <= 1 - tail_probability. The first iteration
+      is always kept, since there is no earlier rotation to fold its rotation
+      into. Even a stage learned from data that is already gaussian deviates
+      from the identity by a few times marginal_noise_level, so tol has to be
+      above that to drop anything. Default 3 * marginal_noise_level
+  tail_probability : float, optional
+      The probability in each tail that is left out when comparing the
+      marginal maps with the identity. The few samples that land in the
+      tails make the learned maps noisy there, so that even a fully
+      converged model rarely comes close to the identity in its tails.
+      Default 1e-3
+  validation_data : ndarray, optional
+      If given, a 2D array [DxN] of samples on which to measure the actual
+      difference between the original and the optimized transforms
+
+  Returns
+  -------
+  optimized : RBIGModel
+      The pruned model. Its rotations are dense matrices if any were folded.
+  report : dictionary
+      'tol', the tolerance used,
+      'kept_iterations', the indices of the original iterations that remain,
+      'marginal_deviation', a 1D array [I] giving each original iteration's
+      maximum deviation from the identity, 'error_estimate', the sum of
+      the dropped stages' deviations times sqrt(D), which is the Euclidean
+      error if later stages neither shrink nor stretch it, and
+      'error_bound', a worst-case bound on the Euclidean distance between
+      the outputs of the two transforms for any input that stays within the
+      compared range of every learned CDF. The bound multiplies each dropped
+      stage's deviation by the steepest slope of every later marginal stage,
+      so it is usually very loose. If validation_data was given, also
+      'validation_error' and 'validation_error_99', the largest and the 99th
+      percentile absolute differences between the outputs, over the samples
+      that both transforms map to finite values, and 'validation_nonfinite',
+      the number of samples that the original transform maps to finite
+      values but the optimized one does not (because they leave the support
+      of a learned CDF once the stages before it are dropped).
+  """
+  if isinstance(transform_params, CompiledRBIG):
+    model = transform_params.model
+  else:
+    model = as_rbig_model(transform_params)
+
+  if tol is None:
+    tol = 3 * marginal_noise_level(model, tail_probability)
+  deviation = np.array([marginal_identity_deviation(model, rbig_iter,
+                                                   tail_probability)
+                        for rbig_iter in range(model.num_iters)])
+  keep = deviation > tol
+  keep[0] = True
+  kept_iterations = np.flatnonzero(keep)
+
+  if np.all(keep):
+    rotation_matrix = (None if model.rotation_matrix is None else
+                       model.rotation_matrix.copy())
+    householder_vectors = (None if model.householder_vectors is None else
+                           model.householder_vectors.copy())
+  else:
+    rotation_matrix = np.empty((len(kept_iterations), model.num_components,
+                                model.num_components), dtype=model.dtype)
+    householder_vectors = None
+    new_iter = -1
+    for rbig_iter in range(model.num_iters):
+      if keep[rbig_iter]:
+        new_iter += 1
+        rotation_matrix[new_iter] = model.dense_rotation(rbig_iter)
+      else:
+        rotation_matrix[new_iter] = np.dot(model.dense_rotation(rbig_iter),
+                                           rotation_matrix[new_iter])
+
+  marginal_params = {name: getattr(model, name)[kept_iterations]
+                     for name in MARGINAL_PARAM_NAMES}
+  diagnostics = {name: np.asarray(values)[kept_iterations]
+                 for name, values in model.diagnostics.items()}
+  optimized = RBIGModel(marginal_params['uniform_cdf_support'],
+                        marginal_params['uniform_cdf'],
+                        marginal_params['empirical_pdf_support'],
+                        marginal_params['empirical_pdf'], rotation_matrix,
+                        model.pdf_extension, model.pdf_resolution,
+                        diagnostics, householder_vectors)
+
+  # the error in the output grows by at most the steepest slope of each kept
+  # marginal stage, and a dropped stage adds at most its deviation in each
+  # component. The rotations don't change Euclidean distances.
+  error_bound = 0.0
+  for rbig_iter in range(model.num_iters):
+    if keep[rbig_iter]:
+      if error_bound > 0:
+        error_bound *= marginal_lipschitz_constant(model, rbig_iter,
+                                                   tail_probability)
+    else:
+      error_bound += np.sqrt(model.num_components) * deviation[rbig_iter]
+
+  report = {'tol': tol, 'kept_iterations': kept_iterations,
+            'marginal_deviation': deviation,
+            'error_estimate': np.sqrt(model.num_components) *
+                              np.sum(deviation[~keep]),
+            'error_bound': error_bound}
+  if validation_data is not None:
+    original_output = compile_rbig(model).forward(validation_data)
+    optimized_output = compile_rbig(optimized).forward(validation_data)
+    original_finite = np.all(np.isfinite(original_output), axis=0)
+    both_finite = original_finite & np.all(np.isfinite(optimized_output),
+                                           axis=0)
+    difference = np.abs(original_output[:, both_finite] -
+                        optimized_output[:, both_finite])
+    report['validation_error'] = np.max(difference, initial=0.0)
+    report['validation_error_99'] = (np.percentile(difference, 99)
+                                     if difference.size else 0.0)
+    report['validation_nonfinite'] = int(np.sum(original_finite &
+                                                ~both_finite))
+  return optimized, report
+
+
+def marginal_identity_deviation(model, rbig_iter, tail_probability=0.0):
+  """
+  How far the marginal stage of one iteration is from the identity
+
+  Returns
+  -------
+  deviation : float
+      The maximum over components, and over the tabulated points of each CDF
+      with tail_probability <= F(x) <= 1 - tail_probability (and strictly
+      inside (0, 1)), of |ndtri(F(x)) - x|
+  """
+  cdf = model.uniform_cdf[rbig_iter]
+  interior = _central(cdf, tail_probability)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    distance = np.abs(ndtri(cdf) - model.uniform_cdf_support[rbig_iter])
+  return np.max(distance, where=interior, initial=0.0)
+
+
+def marginal_noise_level(model, tail_probability=1e-3):
+  """
+  The typical deviation from the identity of a stage fit to gaussian data
+
+  The learned CDFs are estimated from histograms of n samples (n is
+  recovered from the number of bins, int(sqrt(n))). At probability p the
+  empirical quantile has a standard error of sqrt(p(1-p)/n) / phi(ndtri(p))
+  in gaussian units, which is largest at the most extreme p compared, p =
+  max(tail_probability, 1/n). marginal_identity_deviation of a stage fit to
+  data that was already gaussian is typically one to four times this.
+  """
+  num_samples = (model.empirical_pdf.shape[2] - 2)**2
+  probability = max(tail_probability, 1 / num_samples)
+  quantile = ndtri(probability)
+  return (np.sqrt(probability * (1 - probability) / num_samples) *
+          np.sqrt(2 * np.pi) * np.exp(0.5 * quantile**2))
+
+
+def marginal_lipschitz_constant(model, rbig_iter, tail_probability=0.0):
+  """
+  The steepest slope of the marginal stage of one iteration
+
+  The derivative of x -> ndtri(F(x)) on a CDF segment is the segment's slope
+  divided by the gaussian pdf at the mapped point. Only the segments with
+  both ends inside the range compared by marginal_identity_deviation are
+  considered, which always leaves out the first and last segments, since
+  they map into the infinite tails.
+  """
+  cdf = model.uniform_cdf[rbig_iter]
+  support = model.uniform_cdf_support[rbig_iter]
+  central = _central(cdf, tail_probability)
+  central = central[:, :-1] & central[:, 1:]
+  slopes = np.diff(cdf, axis=1) / np.diff(support, axis=1)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    gaussian = np.abs(ndtri(cdf))
+  largest_abs = np.maximum(gaussian[:, :-1], gaussian[:, 1:])
+  with np.errstate(over='ignore', invalid='ignore'):
+    derivative = slopes * np.sqrt(2 * np.pi) * np.exp(0.5 * largest_abs**2)
+  return np.max(derivative, where=central, initial=0.0)
+
+
+def _central(cdf, tail_probability):
+  """Which points of the CDFs are compared with the identity"""
+  return ((cdf > 0) & (cdf < 1) & (cdf >= tail_probability) &
+          (cdf <= 1 - tail_probability))
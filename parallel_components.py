@@ -0,0 +1,85 @@
+"""
+This file defines helpers for running per-component work on several cores
+
+Within an RBIG iteration the marginal transforms of the different components
+are independent, so they can be split into blocks of rows and handed to a pool
+of workers. The heavy lifting is done in numpy/scipy, which releases the GIL,
+so a thread pool gives real parallelism while letting every worker read and
+write the same arrays in place. Each row is always processed by exactly the
+same code, so the results do not depend on the number of workers.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+
+def resolve_n_jobs(n_jobs):
+  """
+  Turns the n_jobs argument into a number of workers
+
+  None means 1 (serial), negative values count back from the number of cores,
+  so -1 means all of them.
+  """
+  if n_jobs is None:
+    return 1
+  if n_jobs < 0:
+    return max(1, os.cpu_count() + 1 + n_jobs)
+  return n_jobs
+
+
+@contextmanager
+def component_executor(n_jobs=None, executor=None):
+  """
+  Provides the executor that per-component work should be submitted to
+
+  Parameters
+  ----------
+  n_jobs : int, optional
+      The number of worker threads to start if executor is not given. See
+      resolve_n_jobs
+  executor : concurrent.futures.Executor, optional
+      A user-managed executor. It is used as-is and not shut down. Its workers
+      must share memory with the caller, e.g. a ThreadPoolExecutor.
+
+  Yields
+  ------
+  executor : concurrent.futures.Executor or None
+      None if the work should just be run serially in the calling thread
+  """
+  if executor is not None:
+    yield executor
+  elif resolve_n_jobs(n_jobs) > 1:
+    with ThreadPoolExecutor(resolve_n_jobs(n_jobs)) as pool:
+      yield pool
+  else:
+    yield None
+
+
+def run_component_blocks(func, num_components, executor=None, n_jobs=None):
+  """
+  Calls func on contiguous blocks of component indices, in parallel
+
+  Parameters
+  ----------
+  func : callable
+      Takes a slice of component (row) indices. It should write its results
+      into preallocated outputs rather than return them.
+  num_components : int
+      The total number of components
+  executor : concurrent.futures.Executor, optional
+      Where to run the blocks. If None, func is called once on all components.
+  n_jobs : int, optional
+      The number of blocks to split the components into. Defaults to the
+      number of cores.
+  """
+  if executor is None:
+    func(slice(0, num_components))
+    return
+  num_blocks = min(num_components, resolve_n_jobs(
+      n_jobs if n_jobs is not None else -1))
+  block_edges = np.linspace(0, num_components, num_blocks + 1).astype(int)
+  blocks = [slice(block_edges[i], block_edges[i+1])
+            for i in range(num_blocks)]
+  for _ in executor.map(func, blocks):
+    pass  # consume the results so that exceptions in the workers propagate
@@ -0,0 +1,74 @@
+"""
+This file defines a randomized PCA rotation for high-dimensional RBIG
+
+The 'PCA' rotation in rbig() forms the [DxD] covariance matrix (an O(D^2 N)
+product) and then takes its full SVD (O(D^3)) at every iteration. Here we
+instead find only the leading principal directions with a randomized range
+finder (Halko, Martinsson & Tropp 2011), which touches the data through a
+couple of [DxN] x [Nxl] products, and complete them to a full orthonormal
+basis with a single QR factorization.
+"""
+
+import numpy as np
+
+def randomized_pca_rotation(data, rank, num_oversamples=10, num_power_iters=1,
+                            warm_start=True):
+  """
+  Finds an orthogonal rotation whose leading rows are the top principal axes
+
+  Parameters
+  ----------
+  data : ndarray
+      A 2D array [DxN] giving an iid sample in each column. It is assumed to be
+      (approximately) zero mean, as marginally gaussianized data is.
+  rank : int
+      The number of leading principal directions to estimate. The remaining
+      D - rank rows of the rotation span the orthogonal complement in no
+      particular order.
+  num_oversamples : int, optional
+      Extra random directions used in the sketch to improve accuracy. Default
+      10.
+  num_power_iters : int, optional
+      Number of power (subspace) iterations to sharpen the estimate. Default 1
+  warm_start : bool, optional
+      If True, include the first rank coordinate axes in the sketch. Within
+      rbig() the data has already been rotated onto the principal axes of the
+      previous iteration, so these are the previous solution expressed in the
+      current coordinates, and any part of it that is still accurate is
+      recovered without extra power iterations. Default True.
+
+  Returns
+  -------
+  rotation_matrix : ndarray
+      A 2D orthogonal array [DxD] that is applied to the data by
+      left-multiplication, of the same dtype as the data
+  """
+  num_components, num_samples = data.shape
+  rank = min(rank, num_components)
+  sketch_size = min(num_components, rank + num_oversamples)
+
+  test_matrix = np.random.randn(num_components,
+                                sketch_size).astype(data.dtype, copy=False)
+  #^ match the data's dtype so that the products don't upcast the data
+  if warm_start:
+    test_matrix[:, :rank] = np.eye(num_components, rank)
+
+  # C * test_matrix without ever forming the covariance C
+  sketch = np.dot(data, np.dot(data.T, test_matrix)) / num_samples
+  for _ in range(num_power_iters):
+    basis, _ = np.linalg.qr(sketch)
+    sketch = np.dot(data, np.dot(data.T, basis)) / num_samples
+  basis, _ = np.linalg.qr(sketch)
+
+  # covariance projected into the small subspace, then its eigenvectors
+  projected = np.dot(basis.T, data)
+  small_cov = np.dot(projected, projected.T) / num_samples
+  eigvals, eigvecs = np.linalg.eigh(small_cov)
+  order = np.argsort(eigvals)[::-1][:rank]
+  principal_axes = np.dot(basis, eigvecs[:, order])
+
+  # complete to a full orthonormal basis; Q's first rank columns span the same
+  # space as principal_axes, so the rest span its orthogonal complement
+  full_basis, _ = np.linalg.qr(principal_axes, mode='complete')
+  full_basis[:, :rank] = principal_axes
+  return full_basis.T
@@ -2,12 +2,30 @@
 This file defines the rbig function which iteratively gaussianizes data
 """
 
+import logging
+import os
 import numpy as np
 from scipy.stats import ortho_group
-from univariate_make_normal import univariate_make_normal
+from multivariate_make_normal import estimate_marginal_params
+from rbig_model import RBIGModel, as_rbig_model
+from compiled_rbig import CompiledRBIG, compile_rbig, _column_chunks
+from rbig_io import save_rbig_model
+from information_reduction import marginal_negentropy
+from randomized_pca import randomized_pca_rotation
+from householder_rotation import (random_householder_vectors,
+                                  default_num_reflections)
+from parallel_components import component_executor, run_component_blocks
+from instrumentation import IterationProfiler, STAGE_NAMES
+
+logger = logging.getLogger('rbig')
 
 def rbig(data, num_iters, rotation_type, pdf_extension=0.1,
-         pdf_resolution=1000, progress_report_interval=None):
+         pdf_resolution=1000, progress_report_interval=None, n_jobs=None,
+         executor=None, monotonic_method='laparra', convergence_tol=None,
+         convergence_patience=3, pca_rank=None, num_reflections=None,
+         subsample_size=None, callback=None, dtype=np.float64,
+         inplace=False, initial_model=None, data_is_gaussianized=False,
+         checkpoint_path=None, checkpoint_interval=None):
   """
   Rotation-based iterative gaussianization
 
@@ -17,12 +35,21 @@ def rbig(data, num_iters, rotation_type, pdf_extension=0.1,
       A 2D array giving an iid sample in each column. Number of rows is the
       number of components in each datapoint.
   num_iters : int
-      The number of steps to run the sequence of marginal gaussianization and
-      then rotation
+      The (maximum) number of steps to run the sequence of marginal
+      gaussianization and then rotation. With initial_model, the number of
+      steps to add to it
   rotation_type : str
-      One of {'PCA', 'random'}. The type of orthogonal linear transform to
-      apply to gaussianized data at each iteration. Later will add ICA
-      rotation based on FastICA
+      One of {'PCA', 'randomized_PCA', 'random', 'householder'}. The type of
+      orthogonal linear transform to apply to gaussianized data at each
+      iteration. 'randomized_PCA' estimates only the leading pca_rank
+      principal axes with a randomized SVD, warm-started from the previous
+      iteration's axes, which is much cheaper than 'PCA' for high-dimensional
+      data. See randomized_pca.py. 'householder' is a random product of
+      num_reflections Householder reflections, which is stored and applied in
+      O(kD) rather than the O(D^2) of a dense 'random' rotation. It only mixes
+      components within a k-dimensional subspace, though, so with the default
+      k and large D it mixes weakly, and more iterations are needed. See
+      householder_rotation.py. Later will add ICA rotation based on FastICA
   pdf_extension : float
       The fraction by which to extend the support of the gaussianized marginal
       pdf compared to the empirical marginal pdf
@@ -33,57 +60,364 @@ def rbig(data, num_iters, rotation_type, pdf_extension=0.1,
       with high-dimensional data consider reducing this resolution to shorten
       computation time.
   progress_report_interval : int, optional
-      If specified, report the RBIG iteration number every
-      progress_report_interval iterations.
-  """
-  parameter_lookup = {'pdf_extension': pdf_extension,
-                      'pdf_resolution': pdf_resolution,
-                      'iterations': {}}
-  #^ we'll use this to also store parameters of the gaussianizing transform
-  # at each iteration
+      If specified, log the RBIG iteration number and the time spent in each
+      stage every progress_report_interval iterations, at INFO level on the
+      'rbig' logger (configure it with the logging module to see the
+      reports). Other iterations are logged at DEBUG level.
+  n_jobs : int, optional
+      If greater than 1, split the marginal gaussianization of each iteration
+      across this many threads. -1 means use all cores. The result does not
+      depend on the number of threads.
+  executor : concurrent.futures.Executor, optional
+      Run the marginal gaussianization on this (thread-based) executor instead
+      of one created for the call. See parallel_components.py
+  monotonic_method : str, optional
+      One of {'laparra', 'vectorized'}. How the learned marginal CDFs are
+      forced to be strictly increasing. 'vectorized' is much faster and agrees
+      with the original 'laparra' correction to within ~1e-11. See
+      make_cdf_monotonic in univariate_make_normal.py. Default 'laparra'.
+  convergence_tol : float, optional
+      If specified, stop early once the reduction in total correlation (in
+      nats) achieved by an iteration has been below this for
+      convergence_patience iterations in a row. The reduction is estimated
+      from the histograms as the summed marginal negentropy, see
+      information_reduction.py. Even for perfectly gaussian data this estimate
+      is of order 1e-3 per component at 10^4 samples, so the tolerance should
+      be set above that noise floor.
+  convergence_patience : int, optional
+      See convergence_tol. Default 3.
+  pca_rank : int, optional
+      The number of principal axes estimated at each iteration when
+      rotation_type is 'randomized_PCA'. Default a tenth of the number of
+      components (at least 1).
+  num_reflections : int, optional
+      The number of reflections k in each rotation when rotation_type is
+      'householder'. Default ceil(log2(D)) + 1, which is cheap but mixes
+      weakly for large D (see rotation_type). Up to D, a larger k mixes
+      more per iteration at O(kD) cost.
+  subsample_size : int, optional
+      If given (and smaller than the number of samples), the marginal CDFs and
+      the rotation of each iteration are estimated from a fresh random
+      subsample of this many columns, and then applied to all of the data.
+      Only the estimation gets cheaper: every iteration still applies its
+      marginal transforms and rotation to all of the data, which usually
+      takes most of the time anyway. So however small the subsample, expect
+      the fit to be at most about twice as fast (1.4x for 3x2M data and a
+      subsample of 2000, 1.9x for 50x400k data and a subsample of 400). The
+      marginal pdfs have int(sqrt(subsample_size)) bins.
+      The support of each CDF is widened to the range of the full data, so
+      the model maps every training sample to a finite value, and g_data is
+      exactly apply_rbig(data, model). Samples that fall in histogram bins
+      the subsample left empty land where a CDF is flat, though, and are
+      merged there with their neighbours, so invert_rbig(g_data) does not
+      recover them exactly.
+  callback : callable, optional
+      Called after every iteration with a dictionary of statistics about it:
+      'iteration', 'information_reduction' and 'num_unimproved_iters' (see
+      convergence_tol), the seconds spent on marginal gaussianization
+      ('marginal_time'), on the monotonic correction of the CDFs within it
+      ('monotonic_time'), and on learning and applying the rotation
+      ('rotation_time'), and 'peak_bytes', the peak memory allocated during
+      the iteration if tracemalloc is tracing (None otherwise). See
+      instrumentation.py. If the callback returns True, fitting stops after
+      this iteration.
+  dtype : data-type, optional
+      The dtype in which to hold the gaussianized data and the rotations,
+      e.g. np.float32 to halve their memory and speed up the rotations. The
+      marginal CDFs are estimated and evaluated in float64, and the results
+      cast to dtype. Default float64
+  inplace : bool, optional
+      Use data itself as working memory, overwriting it with g_data, instead
+      of copying it. data must then already be of the requested dtype. Each
+      marginal stage is estimated from histograms and then applied in place,
+      a block of columns at a time, and the rotations alternate between data
+      and a single scratch array. So the fit needs one [DxN] array on top of
+      data (two without inplace), and apart from temporaries of a fixed size
+      (and the subsample, if any) allocates nothing per iteration. Default
+      False
+  initial_model : CompiledRBIG, RBIGModel, or dictionary, optional
+      A previously learned transform to continue fitting, for instance one
+      that stopped short of convergence or was loaded from a checkpoint. The
+      data is pushed through it and num_iters more iterations are learned on
+      top of it; the returned model holds its iterations followed by the new
+      ones. Its pdf_extension and pdf_resolution are used in place of the
+      arguments, and it must have been fit to the same number of components
+      and the same number of samples (or subsample_size). Resuming the
+      'PCA' rotation on the same float64 data gives exactly the model that
+      fitting all of the iterations at once would have.
+  data_is_gaussianized : bool, optional
+      If True, data has already been transformed by initial_model (it is,
+      say, the g_data returned along with it), so that step is skipped.
+      Default False
+  checkpoint_path : str, optional
+      If given, the model learned so far (including initial_model) is saved
+      here with save_rbig_model every checkpoint_interval iterations, and
+      once more when fitting finishes. Each checkpoint replaces the previous
+      one atomically, so the file always holds a complete model. To recover
+      from an interruption, load it with load_rbig_model and pass it back as
+      initial_model.
+  checkpoint_interval : int, optional
+      See checkpoint_path. Default None, only save when fitting finishes
 
+  Returns
+  -------
+  g_data : ndarray
+      The gaussianized data, same size as the input
+  model : RBIGModel
+      The parameters of the learned transform. This can be indexed like the
+      nested parameter_lookup dictionary described in apply_rbig.py. Its
+      diagnostics['information_reduction'] holds the estimated reduction in
+      total correlation achieved by each iteration, and
+      diagnostics['<stage>_time'] the seconds spent on each of the stages
+      described under callback. With initial_model, this includes its
+      iterations.
+  """
   num_components = data.shape[0]
   num_samples = data.shape[1]
-  g_data = np.copy(data)  # gaussianized data
-
-  for rbig_iter in range(num_iters):
-    if progress_report_interval is not None:
-      if rbig_iter % progress_report_interval == 0:
-        print("Completed ", rbig_iter, "iterations of RBIG")
-    # Marginal gaussianization
-    for c_idx in range(num_components):
-      if c_idx == 0:
-        parameter_lookup['iterations'][rbig_iter] = {}
-
-      g_data[c_idx, :], params = univariate_make_normal(g_data[c_idx, :],
-                                                        pdf_extension,
-                                                        pdf_resolution)
-      parameter_lookup['iterations'][rbig_iter][c_idx] = params
-
-    # Rotation
-    if rotation_type == 'random':
-      rand_ortho_matrix = ortho_group.rvs(num_components)
-      g_data = np.dot(rand_ortho_matrix, g_data)
-      parameter_lookup['iterations'][
-          rbig_iter]['rotation_matrix'] = rand_ortho_matrix
-
-    elif rotation_type == 'PCA':
-      if num_components > num_samples or num_components > 10**6:
-        # If the dimensionality of each datapoint is high, we probably
-        # want to compute the SVD of the data directly to avoid forming a huge
-        # covariance matrix
-        U, _, _ = np.linalg.svd(g_data, full_matrices=True)
+  if initial_model is not None:
+    if isinstance(initial_model, CompiledRBIG):
+      initial_model = initial_model.model
+    else:
+      initial_model = as_rbig_model(initial_model)
+    pdf_extension = initial_model.pdf_extension
+    pdf_resolution = initial_model.pdf_resolution
+    first_iter = initial_model.num_iters
+  else:
+    first_iter = 0
+  if subsample_size is not None and subsample_size >= num_samples:
+    subsample_size = None
+  if rotation_type == 'householder':
+    if num_reflections is None:
+      num_reflections = default_num_reflections(num_components)
+  else:
+    num_reflections = None
+  model = RBIGModel.empty(num_iters, num_components,
+                          num_samples if subsample_size is None else
+                          subsample_size,
+                          pdf_extension, pdf_resolution, num_reflections,
+                          dtype)
+  #^ we'll use this to store parameters of the gaussianizing transform
+  # at each iteration
+  if (initial_model is not None and initial_model.empirical_pdf.shape[1:] !=
+      model.empirical_pdf.shape[1:]):
+    raise ValueError('initial_model was fit to data with a different number '
+                     'of components or samples')
+  if inplace and data.dtype != dtype:
+    raise ValueError('inplace requires data of dtype ' +
+                     str(np.dtype(dtype)) + ', not ' + str(data.dtype))
+  learned_transform = CompiledRBIG(
+      model, np.empty(model.uniform_cdf.shape[:2] +
+                      (model.uniform_cdf.shape[2] - 1,)))
+  #^ applies each marginal stage as soon as it is learned; its slopes are
+  #^ filled in along with the model
+  information_reduction = np.zeros(num_iters)
+  stage_times = {name: np.zeros(num_iters) for name in STAGE_NAMES}
+  model.diagnostics['information_reduction'] = information_reduction
+  for name in STAGE_NAMES:
+    model.diagnostics[name + '_time'] = stage_times[name]
+  profiler = IterationProfiler()
+  num_unimproved_iters = 0
+  num_completed_iters = 0
+
+  with component_executor(n_jobs, executor) as pool:
+    scratch = np.empty(data.shape, dtype=dtype)
+    #^ the rotations alternate between g_data and this
+    if initial_model is not None and not data_is_gaussianized:
+      g_data = compile_rbig(initial_model).forward(
+          data, n_jobs, pool, dtype, work=scratch, inplace=inplace)
+    elif inplace:
+      g_data = data  # gaussianized data
+    else:
+      g_data = np.array(data, dtype=dtype)
+
+    if subsample_size is not None:
+      # seeded from the global state, like the rest of the fit, but unlike
+      # np.random.choice it draws a subsample without permuting all N columns
+      subsample_rng = np.random.default_rng(np.random.randint(2**31))
+    for rbig_iter in range(num_iters):
+      profiler.start()
+      if subsample_size is None:
+        sample_idx = None
       else:
-        # the SVD is more numerically stable then eig so we'll use it on the 
-        # covariance matrix directly
-        U, _, _ = np.linalg.svd(np.dot(g_data, g_data.T) / num_samples, 
-                                full_matrices=True)
+        sample_idx = np.sort(subsample_rng.choice(
+            num_samples, subsample_size, replace=False, shuffle=False))
+      # Marginal gaussianization, all of the components at once
+      with profiler.stage('marginal'):
+        negentropy = _gaussianize_marginals(
+            g_data, learned_transform, rbig_iter, monotonic_method, pool,
+            n_jobs, sample_idx, profiler)
+      information_reduction[rbig_iter] = np.sum(negentropy)
+
+      # Rotation
+      with profiler.stage('rotation'):
+        model.set_rotation(rbig_iter, _learn_rotation(
+            g_data if sample_idx is None else g_data[:, sample_idx],
+            rotation_type, pca_rank, num_reflections))
+        model.rotate(rbig_iter, g_data, out=scratch)
+        g_data, scratch = scratch, g_data
+      num_completed_iters += 1
 
-      g_data = np.dot(U.T, g_data)
-      parameter_lookup['iterations'][
-          rbig_iter]['rotation_matrix'] = U.T
+      # Convergence
+      if convergence_tol is not None:
+        if information_reduction[rbig_iter] < convergence_tol:
+          num_unimproved_iters += 1
+        else:
+          num_unimproved_iters = 0
+
+      # Instrumentation
+      iteration_stats = profiler.results()
+      for name in STAGE_NAMES:
+        stage_times[name][rbig_iter] = iteration_stats[name + '_time']
+      iteration_stats.update(
+          iteration=first_iter + rbig_iter,
+          information_reduction=float(information_reduction[rbig_iter]),
+          num_unimproved_iters=num_unimproved_iters)
+      _log_iteration(iteration_stats, progress_report_interval)
+      stop_requested = callback is not None and callback(iteration_stats)
+
+      if (checkpoint_path is not None and checkpoint_interval is not None and
+          num_completed_iters % checkpoint_interval == 0):
+        _save_checkpoint(checkpoint_path, initial_model,
+                         model.head(num_completed_iters))
+
+      if stop_requested or (convergence_tol is not None and
+                            num_unimproved_iters >= convergence_patience):
+        break
+
+  if inplace and g_data is not data:
+    np.copyto(data, g_data)
+    g_data = data
+
+  model.truncate(num_completed_iters)
+  if initial_model is not None:
+    model = initial_model.concatenate(model)
+  if checkpoint_path is not None and (checkpoint_interval is None or
+                                      num_completed_iters %
+                                      checkpoint_interval != 0):
+    _save_checkpoint(checkpoint_path, None, model)
+
+  return g_data, model
+
+
+def _save_checkpoint(checkpoint_path, initial_model, model):
+  """
+  Saves initial_model followed by model, replacing checkpoint_path atomically
+  """
+  if initial_model is not None:
+    model = initial_model.concatenate(model)
+  partial_path = checkpoint_path + '.partial'
+  save_rbig_model(partial_path, model, include_compiled=False)
+  os.replace(partial_path, checkpoint_path)
+  logger.info('Saved a checkpoint of %d iterations of RBIG to %s',
+              model.num_iters, checkpoint_path)
 
+
+def _log_iteration(iteration_stats, progress_report_interval):
+  """Reports an iteration, at INFO level every progress_report_interval"""
+  num_completed = iteration_stats['iteration'] + 1
+  if (progress_report_interval is not None and
+      num_completed % progress_report_interval == 0):
+    level = logging.INFO
+  else:
+    level = logging.DEBUG
+  if logger.isEnabledFor(level):
+    logger.log(level, 'Completed %d iterations of RBIG (marginal %.3fs, of '
+               'which monotonic %.3fs, rotation %.3fs, information reduction '
+               '%.4g)', num_completed, iteration_stats['marginal_time'],
+               iteration_stats['monotonic_time'],
+               iteration_stats['rotation_time'],
+               iteration_stats['information_reduction'])
+
+
+def _gaussianize_marginals(g_data, learned_transform, rbig_iter,
+                           monotonic_method, executor, n_jobs, sample_idx=None,
+                           profiler=None):
+  """
+  Marginally gaussianizes g_data in place, storing the parameters in the model
+
+  The components are split into blocks that are handled by the executor (or
+  all at once in this thread if it is None). Each block's CDFs are estimated
+  from its histograms, and then applied in place by learned_transform (a
+  CompiledRBIG of the model being fit), a block of columns at a time, so
+  nothing the size of the data is allocated. Returns the estimated
+  negentropy of each component before gaussianization. If sample_idx is
+  given, the marginals are estimated from just those columns of g_data.
+  """
+  model = learned_transform.model
+  negentropy = np.empty(g_data.shape[0])
+
+  def gaussianize_block(rows):
+    if sample_idx is None:
+      estimation_data = g_data[rows]
+      support_min = support_max = None
     else:
-      raise ValueError('Rotation type ' + rotation_type + ' not recognized')
+      estimation_data = g_data[rows][:, sample_idx]
+      # the CDFs have to cover every sample, not just those in the subsample,
+      # so that the model maps all of the data to finite values
+      support_min = np.min(g_data[rows], axis=1).astype(np.float64)
+      support_max = np.max(g_data[rows], axis=1).astype(np.float64)
+    # before estimation_data, which may be a view, is overwritten
+    variance = _variance(estimation_data)
+    params = estimate_marginal_params(
+        estimation_data, model.pdf_extension, model.pdf_resolution,
+        monotonic_method, profiler, support_min, support_max)
+    model.set_marginal_params(rbig_iter, params, rows)
+    learned_transform._update_slopes(rbig_iter, rows)
+    learned_transform._gaussianize_rows(rbig_iter, g_data, g_data, rows)
+    negentropy[rows] = marginal_negentropy(
+        params['empirical_pdf'], params['empirical_pdf_support'], variance,
+        estimation_data.shape[1])
+
+  run_component_blocks(gaussianize_block, g_data.shape[0], executor, n_jobs)
+  return negentropy
+
+
+def _variance(data):
+  """The variance of each row of data, without a temporary of its size"""
+  mean = np.mean(data, axis=1, dtype=np.float64)
+  sum_of_squares = np.zeros(data.shape[0])
+  for cols in _column_chunks(data.shape[1], slice(None), data.shape[0]):
+    deviation = data[:, cols] - mean[:, None]
+    sum_of_squares += np.sum(deviation * deviation, axis=1)
+  return sum_of_squares / data.shape[1]
+
+
+def _learn_rotation(g_data, rotation_type, pca_rank=None,
+                    num_reflections=None):
+  """
+  Learns the orthogonal transform to apply to the marginally gaussian data
+
+  Returns
+  -------
+  rotation : ndarray
+      A 2D array [DxD] that is applied to the data by left-multiplication or,
+      for the 'householder' rotation type, the [kxD] Householder vectors
+  """
+  num_components, num_samples = g_data.shape
+  if rotation_type == 'random':
+    return ortho_group.rvs(num_components)
+
+  elif rotation_type == 'PCA':
+    if num_components > num_samples or num_components > 10**6:
+      # If the dimensionality of each datapoint is high, we probably
+      # want to compute the SVD of the data directly to avoid forming a huge
+      # covariance matrix
+      U, _, _ = np.linalg.svd(g_data, full_matrices=True)
+    else:
+      # the SVD is more numerically stable then eig so we'll use it on the 
+      # covariance matrix directly
+      U, _, _ = np.linalg.svd(
+          np.dot(g_data, g_data.T).astype(np.float64, copy=False) /
+          num_samples, full_matrices=True)
+    return U.T.astype(g_data.dtype, copy=False)
+
+  elif rotation_type == 'randomized_PCA':
+    if pca_rank is None:
+      pca_rank = max(1, num_components // 10)
+    return randomized_pca_rotation(g_data, pca_rank)
+
+  elif rotation_type == 'householder':
+    return random_householder_vectors(num_components, num_reflections)
 
-  return g_data, parameter_lookup
+  else:
+    raise ValueError('Rotation type ' + rotation_type + ' not recognized')
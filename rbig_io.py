@@ -0,0 +1,137 @@
+"""
+This file defines saving and loading of RBIG models in a flat binary format
+
+A file holds a small versioned header followed by the raw parameter arrays:
+
+  8 bytes   magic string b'RBIGMODL'
+  4 bytes   little-endian uint32 format version
+  4 bytes   reserved (zero)
+  8 bytes   little-endian uint64 length of the header
+  header    UTF-8 JSON giving the scalar settings of the model and, for each
+            array, its dtype, shape and byte offset within the data section
+  arrays    the data section, starting at the first 64-byte boundary after
+            the header. Each C-ordered array starts on a 64-byte boundary
+
+Because the arrays sit at known offsets, loading with mmap_mode maps them
+straight from the file: a serving process can start without reading the
+parameters, and several processes mapping the same file share its pages.
+The slopes precomputed by CompiledRBIG are stored too, so the compiled
+transform is also available without recomputing anything.
+"""
+
+import json
+import struct
+import numpy as np
+from compiled_rbig import CompiledRBIG, compile_rbig
+from rbig_model import RBIGModel, as_rbig_model
+
+MAGIC = b'RBIGMODL'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sIIQ')
+
+def save_rbig_model(path, transform_params, include_compiled=True):
+  """
+  Saves a learned RBIG transform to a single binary file
+
+  Parameters
+  ----------
+  path : str
+      Where to write the file
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      The learned transform in any of its representations
+  include_compiled : bool, optional
+      Also store the precomputed slopes of the compiled transform, so that
+      loading gives a ready-to-use compiled transform. Default True.
+  """
+  if isinstance(transform_params, CompiledRBIG):
+    model = transform_params.model
+  else:
+    model = as_rbig_model(transform_params)
+  arrays = {name: getattr(model, name) for name in model.param_names}
+  for name in model.diagnostics:
+    arrays['diagnostics/' + name] = np.asarray(model.diagnostics[name])
+  if include_compiled:
+    arrays['uniform_cdf_slopes'] = compile_rbig(model).uniform_cdf_slopes
+
+  layout = {}
+  offset = 0
+  for name, array in arrays.items():
+    layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                    'offset': offset}
+    offset = _align(offset + array.nbytes)
+  header_bytes = json.dumps(
+      {'pdf_extension': model.pdf_extension,
+       'pdf_resolution': int(model.pdf_resolution),
+       'arrays': layout}, sort_keys=True).encode('utf-8')
+  data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+  with open(path, 'wb') as model_file:
+    model_file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0,
+                                    len(header_bytes)))
+    model_file.write(header_bytes)
+    for name, array in arrays.items():
+      model_file.seek(data_start + layout[name]['offset'])
+      np.ascontiguousarray(array).tofile(model_file)
+
+
+def load_rbig_model(path, mmap_mode=None):
+  """
+  Loads an RBIG model saved with save_rbig_model
+
+  Parameters
+  ----------
+  path : str
+      The file to load
+  mmap_mode : str, optional
+      If None (default) the arrays are read into memory. Otherwise one of
+      {'r', 'r+', 'c'}, with the same meaning as for np.memmap, and the arrays
+      are memory-mapped from the file instead.
+
+  Returns
+  -------
+  model : RBIGModel
+      The loaded model. If the file holds the compiled slopes, the model's
+      compiled transform (see compile_rbig) is ready as well.
+  """
+  with open(path, 'rb') as model_file:
+    magic, version, _, header_length = _PREAMBLE.unpack(
+        model_file.read(_PREAMBLE.size))
+    if magic != MAGIC:
+      raise ValueError(path + ' is not an RBIG model file')
+    if version > FORMAT_VERSION:
+      raise ValueError('RBIG model file format version ' + str(version) +
+                       ' is newer than the supported version ' +
+                       str(FORMAT_VERSION))
+    header = json.loads(model_file.read(header_length).decode('utf-8'))
+    data_start = _align(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+      dtype = np.dtype(spec['dtype'])
+      shape = tuple(spec['shape'])
+      if mmap_mode is not None:
+        arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode,
+                                 offset=data_start + spec['offset'],
+                                 shape=shape)
+      else:
+        model_file.seek(data_start + spec['offset'])
+        arrays[name] = np.fromfile(
+            model_file, dtype=dtype,
+            count=int(np.prod(shape))).reshape(shape)
+
+  diagnostics = {name[len('diagnostics/'):]: arrays.pop(name)
+                 for name in list(arrays) if name.startswith('diagnostics/')}
+  uniform_cdf_slopes = arrays.pop('uniform_cdf_slopes', None)
+  model = RBIGModel(arrays['uniform_cdf_support'], arrays['uniform_cdf'],
+                    arrays['empirical_pdf_support'], arrays['empirical_pdf'],
+                    arrays.get('rotation_matrix'), header['pdf_extension'],
+                    header['pdf_resolution'], diagnostics,
+                    arrays.get('householder_vectors'))
+  if uniform_cdf_slopes is not None:
+    model._compiled = CompiledRBIG(model, uniform_cdf_slopes)
+  return model
+
+
+def _align(offset):
+  return -(-offset // ALIGNMENT) * ALIGNMENT
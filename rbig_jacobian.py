@@ -2,63 +2,132 @@
 This file defines functionality for computing the jacobian of the rbig transform
 """
 import numpy as np
-from scipy.stats import norm
-from scipy.interpolate import interp1d
-
-# TODO: do a performance analysis of this function, I don't think its
-# particularly efficient
-
-def rbig_jacobian(original_data, tranform_params):
-
-  num_components = original_data.shape[0]
-  num_samples = original_data.shape[1]  # in all likelihood a subset of the data
-  jacobian = np.zeros((num_samples, num_components, num_components))
-
-  data_rbig = np.copy(original_data)
-  xx = np.zeros([num_components, num_samples])
-  #^ some kind of mask
-  xx[0, :] = np.ones(num_samples)
-  for rbig_iter in range(len(transform_params['iterations'])):
-    temp_gaussian = np.zeros((num_components, num_samples))
-    gaussian_pdf = np.zeros((num_components, num_samples, rbig_iter))
-    #^ not quite sure yet what this is keeping track of...
-    for component_idx in range(num_components):
-      interp_uniform = interp1d(transform_params['iterations'][rbig_iter][
-                                    component_idx]['uniform_cdf_support'],
-                                transform_params['iterations'][rbig_iter][
-                                    component_idx]['uniform_cdf'])
-      data_uniform = learned_interp(data_rbig[component_idx])
-      temp_gaussian[component_idx, :] = norm.ppf(data_uniform)
-      interp_gauss_pdf = interp1d(transform_params['iterations'][rbig_iter][
-                                      component_idx]['empirical_pdf_support'],
-                                  transform_params['iterations'][rbig_iter][
-                                      component_idx]['empirical_pdf'])
-      gaussian_pdf[component_idx, :, rbig_iter] = (
-          interp_gauss_pdf(data_rbig[component_idx]) *
-          (1 / norm.pdf(temp_gaussian[component_idx])))
-
-    xx = np.dot(transform_params['iterations'][rbig_iter]['rotation_matrix'],
-                gaussian_pdf[:, :, rbig_iter] * xx)
-
-    data_rbig = np.dot(
-        transform_params['iterations'][rbig_iter]['rotation_matrix'],
-        temp_gaussian)
-
-  jacobian[:, :, 0] = xx.T
-
-  if num_components > 1:
-    for x_parc in range(1, num_components):
-      xx = np.zeros([num_components, num_samples])
-      xx[x_parc, :] = np.ones(num_samples)
-      for rbig_iter in range(len(tranform_params['iterations'])):
-        xx = np.dot(
-            transform_params['iterations'][rbig_iter]['rotation_matrix'],
-            gaussian_pdf[:, :, rbig_iter] * xx)
-      jacobian[:, :, x_parc] = xx.T
+from scipy.special import ndtri
+from compiled_rbig import compile_rbig
+from parallel_components import component_executor, resolve_n_jobs
+
+DEFAULT_JACOBIAN_MEMORY_BYTES = 2**28
+#^ working memory used while propagating the jacobian, 256MB
+
+def rbig_jacobian(original_data, transform_params, n_jobs=None, executor=None,
+                  max_memory_bytes=None):
+  """
+  Computes the jacobian of the RBIG transform at each sample
+
+  Each iteration multiplies the jacobian by diag(marginal derivatives) and
+  then by the rotation, J <- R diag(d) J. Rather than pushing one basis
+  direction at a time through the whole chain, all D columns of J are
+  propagated together for a block of samples, so every step is one batched
+  matrix product. The samples are processed in chunks sized so that the
+  working arrays stay within max_memory_bytes.
+
+  The marginal derivative of x -> ndtri(F(x)) is F'(x) / phi(ndtri(F(x))),
+  with F' the slope of the CDF segment that x falls in, so that
+  log|det J| agrees with rbig_log_prob in estimate_prob_with_rbig.py up to
+  rounding. That is typically about 1e-15, but the determinant of J loses
+  accuracy in proportion to J's condition number, which for samples in the
+  far tails can reach 1e9 or more.
+
+  Parameters
+  ----------
+  original_data : ndarray
+      A 2D array giving an iid sample in each column
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. See apply_rbig.py
+  n_jobs : int, optional
+      If greater than 1, process this many chunks of samples at once on a
+      thread pool. The samples are split into at least this many chunks, and
+      the memory budget is shared between them.
+  executor : concurrent.futures.Executor, optional
+      A (thread-based) executor to process the chunks on
+  max_memory_bytes : int, optional
+      Budget for the working memory of the computation (not counting the
+      returned jacobian), which sets how many samples are processed at once.
+      Default DEFAULT_JACOBIAN_MEMORY_BYTES
+
+  Returns
+  -------
+  jacobian : ndarray
+      A 3D array [NxDxD]. jacobian[n, i, j] is the derivative of component i
+      of the transformed data with respect to component j of the input, at
+      sample n
+  data_rbig : ndarray
+      original_data, gaussianized using the RBIG transform
+  """
+  compiled_transform = compile_rbig(transform_params)
+  num_components, num_samples = original_data.shape
+  num_workers = 1 if executor is None and n_jobs is None else \
+      resolve_n_jobs(n_jobs if n_jobs is not None else -1)
+  if max_memory_bytes is None:
+    max_memory_bytes = DEFAULT_JACOBIAN_MEMORY_BYTES
+  # at least one chunk per worker, each within its share of the budget
+  chunk_size = min(jacobian_chunk_size(num_components,
+                                       max_memory_bytes / num_workers),
+                   max(1, int(np.ceil(num_samples / num_workers))))
+
+  jacobian = np.empty((num_samples, num_components, num_components))
+  data_rbig = np.empty((num_components, num_samples))
+
+  def jacobian_of_chunk(base_idx):
+    samples = slice(base_idx, base_idx + chunk_size)
+    jacobian[samples], data_rbig[:, samples] = _jacobian_chunk(
+        original_data[:, samples], compiled_transform)
+
+  with component_executor(n_jobs, executor) as pool:
+    chunk_starts = range(0, num_samples, chunk_size)
+    if pool is None:
+      for base_idx in chunk_starts:
+        jacobian_of_chunk(base_idx)
+    else:
+      for _ in pool.map(jacobian_of_chunk, chunk_starts):
+        pass  # consume the results so that exceptions in the workers propagate
 
   return jacobian, data_rbig
 
 
+def jacobian_chunk_size(num_components, max_memory_bytes=None):
+  """
+  The number of samples whose jacobians fit in the memory budget at once
+
+  Propagating the jacobian of a chunk of n samples holds about three [nxDxD]
+  float64 arrays at a time (the current jacobian, its rescaled copy, and the
+  rotated result).
+
+  Parameters
+  ----------
+  num_components : int
+      The dimensionality D of the data
+  max_memory_bytes : int, optional
+      The memory budget. Default DEFAULT_JACOBIAN_MEMORY_BYTES
+  """
+  if max_memory_bytes is None:
+    max_memory_bytes = DEFAULT_JACOBIAN_MEMORY_BYTES
+  bytes_per_sample = 3 * num_components * num_components * 8
+  return max(1, int(max_memory_bytes // bytes_per_sample))
+
 
+def _jacobian_chunk(data, compiled_transform):
+  """Jacobian [nxDxD] and transformed data [Dxn] for one chunk of samples"""
+  model = compiled_transform.model
+  num_components, num_samples = data.shape
+  # we keep the jacobian as [D x n x D], component-major, so that the
+  # rotation is a single product over a [D x (n*D)] view
+  jac = np.zeros((num_components, num_samples, num_components))
+  jac[np.arange(num_components), :, np.arange(num_components)] = 1.0
 
+  data_rbig = data
+  with np.errstate(divide='ignore', invalid='ignore'):
+    for rbig_iter in range(model.num_iters):
+      uniform_data, slopes = compiled_transform.marginal_uniformization(
+          rbig_iter, data_rbig, return_slopes=True)
+      gaussian_data = ndtri(uniform_data)
+      marginal_derivative = slopes * (np.sqrt(2 * np.pi) *
+                                      np.exp(0.5 * gaussian_data**2))
+      #^ F'(x) / phi(g)
+      jac = model.rotate(
+          rbig_iter,
+          (marginal_derivative[:, :, None] * jac).reshape(num_components, -1)
+          ).reshape(num_components, num_samples, num_components)
+      data_rbig = model.rotate(rbig_iter, gaussian_data)
 
+  return jac.transpose(1, 0, 2), data_rbig
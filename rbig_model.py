@@ -0,0 +1,394 @@
+"""
+This file defines the RBIGModel, a compact array-backed store of RBIG parameters
+
+rbig() used to return the transform parameters as a nested dictionary,
+parameter_lookup['iterations'][rbig_iter][component_idx], holding four small
+arrays for every (iteration, component) pair. Here the same parameters are
+held in a handful of contiguous arrays, indexed [rbig_iter, component_idx, :].
+The model still reads like the old dictionary (it is a Mapping with the keys
+'pdf_extension', 'pdf_resolution' and 'iterations') so that existing code
+indexing into parameter_lookup keeps working.
+"""
+
+from collections.abc import Mapping
+import numpy as np
+from householder_rotation import (apply_householder, householder_to_matrix,
+                                  householder_wy_factor)
+
+MARGINAL_PARAM_NAMES = ('empirical_pdf_support', 'empirical_pdf',
+                        'uniform_cdf_support', 'uniform_cdf')
+ROTATION_PARAM_NAMES = ('rotation_matrix', 'householder_vectors')
+
+class RBIGModel(Mapping):
+  """
+  The parameters of a learned RBIG transform, stored as contiguous arrays
+
+  Parameters
+  ----------
+  uniform_cdf_support : ndarray
+      A 3D array [IxDxP] giving, for each iteration and component, the points
+      at which the marginal uniformizing CDF is tabulated. I is the number of
+      RBIG iterations, D the number of components and P the pdf_resolution.
+  uniform_cdf : ndarray
+      A 3D array [IxDxP] giving the marginal uniformizing CDF at those points
+  empirical_pdf_support : ndarray
+      A 3D array [IxDxB] giving the support of the empirical marginal pdfs
+  empirical_pdf : ndarray
+      A 3D array [IxDxB] giving the empirical marginal pdfs
+  rotation_matrix : ndarray or None
+      A 3D array [IxDxD] giving the rotation applied at the end of each
+      iteration. None if the rotations are stored as householder_vectors
+  pdf_extension : float
+      The fraction by which to extend the support of the gaussianized marginal
+      pdf compared to the empirical marginal pdf
+  pdf_resolution : int
+      The number of points at which to compute the gaussianized marginal pdfs.
+  diagnostics : dictionary, optional
+      Per-iteration diagnostics recorded during fitting, each a 1D array [I].
+      See rbig.py
+  householder_vectors : ndarray, optional
+      A 3D array [IxkxD]. If given (and rotation_matrix is None), the rotation
+      of each iteration is the product of the k Householder reflections with
+      these unit vectors, stored in O(kD) rather than O(D^2). See
+      householder_rotation.py
+  """
+  def __init__(self, uniform_cdf_support, uniform_cdf, empirical_pdf_support,
+               empirical_pdf, rotation_matrix, pdf_extension, pdf_resolution,
+               diagnostics=None, householder_vectors=None):
+    self.uniform_cdf_support = uniform_cdf_support
+    self.uniform_cdf = uniform_cdf
+    self.empirical_pdf_support = empirical_pdf_support
+    self.empirical_pdf = empirical_pdf
+    self.rotation_matrix = rotation_matrix
+    self.householder_vectors = householder_vectors
+    self.pdf_extension = pdf_extension
+    self.pdf_resolution = pdf_resolution
+    self.diagnostics = {} if diagnostics is None else diagnostics
+    self._parameter_lookup = None
+    self._compiled = None
+    self._tabulated = None
+    self._householder_wy_factors = None
+
+  @classmethod
+  def empty(cls, num_iters, num_components, num_samples, pdf_extension,
+            pdf_resolution, num_reflections=None, dtype=np.float64):
+    """
+    Allocates a model to be filled in, iteration by iteration, by rbig()
+
+    Parameters
+    ----------
+    num_iters : int
+        The number of RBIG iterations to make room for
+    num_components : int
+        The number of components in each datapoint
+    num_samples : int
+        The number of samples the model will be fit with. This sets the number
+        of bins, and therefore the size, of the empirical marginal pdfs
+    pdf_extension : float
+        See the class docstring
+    pdf_resolution : int
+        See the class docstring
+    num_reflections : int, optional
+        If given, make room for rotations that are products of this many
+        Householder reflections instead of dense matrices
+    dtype : data-type, optional
+        The dtype of the rotations, see the dtype property. The marginal
+        supports and CDFs are always float64. Default float64
+    """
+    num_pdf_points = int(np.sqrt(num_samples)) + 2
+    if num_reflections is None:
+      rotation_matrix = np.zeros((num_iters, num_components, num_components),
+                                 dtype=dtype)
+      householder_vectors = None
+    else:
+      rotation_matrix = None
+      householder_vectors = np.zeros((num_iters, num_reflections,
+                                      num_components), dtype=dtype)
+    return cls(np.zeros((num_iters, num_components, pdf_resolution)),
+               np.zeros((num_iters, num_components, pdf_resolution)),
+               np.zeros((num_iters, num_components, num_pdf_points)),
+               np.zeros((num_iters, num_components, num_pdf_points)),
+               rotation_matrix, pdf_extension, pdf_resolution,
+               householder_vectors=householder_vectors)
+
+  @classmethod
+  def from_parameter_lookup(cls, parameter_lookup):
+    """
+    Packs a nested parameter_lookup dictionary into an RBIGModel
+
+    Parameters
+    ----------
+    parameter_lookup : dictionary
+        Transform parameters in the nested format originally returned by
+        rbig(). See apply_rbig.py for the structure.
+    """
+    iterations = parameter_lookup['iterations']
+    iter_keys = sorted(iterations.keys())
+    component_keys = sorted(k for k in iterations[iter_keys[0]]
+                            if k != 'rotation_matrix')
+    stacked = {
+        name: np.array([[iterations[i][c][name] for c in component_keys]
+                        for i in iter_keys])
+        for name in MARGINAL_PARAM_NAMES}
+    rotation_matrix = np.array([iterations[i]['rotation_matrix']
+                                for i in iter_keys])
+    return cls(stacked['uniform_cdf_support'], stacked['uniform_cdf'],
+               stacked['empirical_pdf_support'], stacked['empirical_pdf'],
+               rotation_matrix, parameter_lookup['pdf_extension'],
+               parameter_lookup['pdf_resolution'])
+
+  @property
+  def num_iters(self):
+    return self.uniform_cdf.shape[0]
+
+  @property
+  def num_components(self):
+    return self.uniform_cdf.shape[1]
+
+  @property
+  def dtype(self):
+    """
+    The dtype that the transform works in, that of its rotations
+
+    Data is transformed in this dtype by default. The marginal transforms are
+    evaluated in float64 and their results cast to it.
+    """
+    if self.rotation_matrix is None:
+      return self.householder_vectors.dtype
+    return self.rotation_matrix.dtype
+
+  @property
+  def param_names(self):
+    """The names of the parameter arrays this model holds"""
+    return MARGINAL_PARAM_NAMES + tuple(
+        name for name in ROTATION_PARAM_NAMES
+        if getattr(self, name) is not None)
+
+  @property
+  def nbytes(self):
+    """Total memory used by the parameter arrays"""
+    return sum(getattr(self, name).nbytes for name in self.param_names)
+
+  def set_marginal_params(self, rbig_iter, params, components=slice(None)):
+    """
+    Stores the stacked marginal parameters of one iteration
+
+    Parameters
+    ----------
+    rbig_iter : int
+        The iteration these parameters belong to
+    params : dictionary
+        Marginal parameters as returned by multivariate_make_normal, each
+        entry a 2D array with one row per component
+    components : slice, optional
+        The components that params holds rows for. Default all of them
+    """
+    for name in MARGINAL_PARAM_NAMES:
+      getattr(self, name)[rbig_iter, components] = params[name]
+
+  def truncate(self, num_iters):
+    """
+    Keeps only the first num_iters iterations, e.g. after stopping early
+
+    The arrays are copied so that the memory of the dropped iterations is
+    released.
+    """
+    if num_iters == self.num_iters:
+      return
+    for name in self.param_names:
+      setattr(self, name, getattr(self, name)[:num_iters].copy())
+    for name in self.diagnostics:
+      self.diagnostics[name] = self.diagnostics[name][:num_iters]
+    self._parameter_lookup = None
+    self._compiled = None
+    self._tabulated = None
+    self._householder_wy_factors = None
+
+  def head(self, num_iters):
+    """
+    A model of just the first num_iters iterations
+
+    Unlike truncate this leaves the model itself alone; the new model's arrays
+    are views into this one's.
+    """
+    rotation_params = {name: (None if getattr(self, name) is None else
+                              getattr(self, name)[:num_iters])
+                       for name in ROTATION_PARAM_NAMES}
+    return RBIGModel(
+        self.uniform_cdf_support[:num_iters], self.uniform_cdf[:num_iters],
+        self.empirical_pdf_support[:num_iters],
+        self.empirical_pdf[:num_iters], rotation_params['rotation_matrix'],
+        self.pdf_extension, self.pdf_resolution,
+        {name: values[:num_iters] for name, values in self.diagnostics.items()},
+        rotation_params['householder_vectors'])
+
+  def concatenate(self, other):
+    """
+    A model that applies the iterations of this model and then those of other
+
+    The two models must have the same number of components and marginal
+    parameters of the same sizes, i.e. the same pdf_resolution and (for the
+    empirical pdfs) the same number of samples. The rotations are stored as
+    Householder vectors if both models store them with the same number of
+    reflections, and as dense matrices otherwise, in the dtype of other's.
+    A diagnostic recorded by only one of the models is nan for the iterations
+    of the other.
+
+    Parameters
+    ----------
+    other : RBIGModel
+        The iterations to append
+
+    Returns
+    -------
+    model : RBIGModel
+        A new model holding copies of both models' parameters
+    """
+    for name in MARGINAL_PARAM_NAMES:
+      if getattr(self, name).shape[1:] != getattr(other, name).shape[1:]:
+        raise ValueError('Cannot concatenate models whose ' + name +
+                         ' have shapes ' + str(getattr(self, name).shape) +
+                         ' and ' + str(getattr(other, name).shape))
+    marginal_params = {name: np.concatenate((getattr(self, name),
+                                             getattr(other, name)))
+                       for name in MARGINAL_PARAM_NAMES}
+    if (self.rotation_matrix is None and other.rotation_matrix is None and
+        self.householder_vectors.shape[1:] ==
+        other.householder_vectors.shape[1:]):
+      rotation_matrix = None
+      householder_vectors = np.concatenate(
+          (self.householder_vectors.astype(other.dtype, copy=False),
+           other.householder_vectors))
+    else:
+      rotation_matrix = np.array(
+          [model.dense_rotation(rbig_iter) for model in (self, other)
+           for rbig_iter in range(model.num_iters)], dtype=other.dtype)
+      householder_vectors = None
+    diagnostics = {}
+    for name in list(self.diagnostics) + [name for name in other.diagnostics
+                                          if name not in self.diagnostics]:
+      diagnostics[name] = np.concatenate(
+          [np.asarray(model.diagnostics[name], dtype=np.float64)
+           if name in model.diagnostics else np.full(model.num_iters, np.nan)
+           for model in (self, other)])
+    return RBIGModel(marginal_params['uniform_cdf_support'],
+                     marginal_params['uniform_cdf'],
+                     marginal_params['empirical_pdf_support'],
+                     marginal_params['empirical_pdf'], rotation_matrix,
+                     self.pdf_extension, self.pdf_resolution, diagnostics,
+                     householder_vectors)
+
+  def set_rotation(self, rbig_iter, rotation):
+    """
+    Stores the rotation of one iteration
+
+    Parameters
+    ----------
+    rbig_iter : int
+        The iteration this rotation belongs to
+    rotation : ndarray
+        A [DxD] rotation matrix or, if the model stores Householder rotations,
+        the [kxD] Householder vectors
+    """
+    if self.householder_vectors is not None:
+      self.householder_vectors[rbig_iter] = rotation
+      self._householder_wy_factors = None
+    else:
+      self.rotation_matrix[rbig_iter] = rotation
+
+  def dense_rotation(self, rbig_iter):
+    """The [DxD] rotation matrix of one iteration, formed if not stored"""
+    if self.rotation_matrix is None:
+      return householder_to_matrix(self.householder_vectors[rbig_iter])
+    return self.rotation_matrix[rbig_iter]
+
+  def component_params(self, rbig_iter, component_idx):
+    """
+    The marginal parameters of a single component, in univariate format
+
+    Returns
+    -------
+    params : dictionary
+        Has the same keys as the params returned by univariate_make_normal.
+        The entries are views into the model's arrays.
+    """
+    return {name: getattr(self, name)[rbig_iter, component_idx]
+            for name in MARGINAL_PARAM_NAMES}
+
+  def rotate(self, rbig_iter, data, out=None):
+    """
+    Applies the rotation of iteration rbig_iter to the columns of data
+
+    If out is given (it must not overlap data) the result is written into it.
+    """
+    if self.rotation_matrix is None:
+      return apply_householder(self.householder_vectors[rbig_iter],
+                               self.householder_wy_factors[rbig_iter], data,
+                               out=out)
+    return np.matmul(self.rotation_matrix[rbig_iter], data, out=out)
+
+  def inverse_rotate(self, rbig_iter, data, out=None):
+    """
+    Undoes the rotation of iteration rbig_iter on the columns of data
+
+    If out is given (it must not overlap data) the result is written into it.
+    """
+    if self.rotation_matrix is None:
+      return apply_householder(self.householder_vectors[rbig_iter],
+                               self.householder_wy_factors[rbig_iter], data,
+                               transpose=True, out=out)
+    return np.matmul(self.rotation_matrix[rbig_iter].T, data, out=out)
+
+  @property
+  def householder_wy_factors(self):
+    """The [Ixkxk] compact WY factors of the Householder rotations, cached"""
+    if self._householder_wy_factors is None:
+      self._householder_wy_factors = np.array(
+          [householder_wy_factor(vectors)
+           for vectors in self.householder_vectors])
+    return self._householder_wy_factors
+
+  @property
+  def parameter_lookup(self):
+    """
+    A view of the model in the old nested-dictionary format
+
+    The arrays in the dictionary are views into the model's arrays, so
+    nothing is copied. The view is built lazily and cached. Rotations stored
+    as Householder vectors are formed into dense matrices for the view.
+    """
+    if self._parameter_lookup is None:
+      iterations = {}
+      for rbig_iter in range(self.num_iters):
+        iterations[rbig_iter] = {
+            c_idx: self.component_params(rbig_iter, c_idx)
+            for c_idx in range(self.num_components)}
+        iterations[rbig_iter]['rotation_matrix'] = \
+            self.dense_rotation(rbig_iter)
+      self._parameter_lookup = {'pdf_extension': self.pdf_extension,
+                                'pdf_resolution': self.pdf_resolution,
+                                'iterations': iterations}
+    return self._parameter_lookup
+
+  def __getitem__(self, key):
+    return self.parameter_lookup[key]
+
+  def __iter__(self):
+    return iter(('pdf_extension', 'pdf_resolution', 'iterations'))
+
+  def __len__(self):
+    return 3
+
+
+def as_rbig_model(transform_params):
+  """
+  Returns transform_params as an RBIGModel, converting from a dict if needed
+
+  Parameters
+  ----------
+  transform_params : RBIGModel or dictionary
+      Either a model or the parameters in the nested parameter_lookup format
+  """
+  if isinstance(transform_params, RBIGModel):
+    return transform_params
+  return RBIGModel.from_parameter_lookup(transform_params)
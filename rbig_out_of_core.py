@@ -0,0 +1,242 @@
+"""
+This file defines out-of-core fitting of RBIG for datasets larger than memory
+
+rbig() holds the whole [DxN] dataset in memory along with a gaussianized copy
+that it rewrites at every iteration. Here the data is instead visited a block
+of columns at a time, and each iteration is fit from a few passes over the
+blocks using statistics that merge across blocks:
+
+  1. the minimum and maximum of each component, which fix the histogram bins
+  2. histogram counts in those fixed bins, which simply add up across blocks,
+     along with the sums needed for each component's variance
+  3. the second moments of the marginally gaussianized data, accumulated for
+     the 'PCA' rotation
+
+The marginal parameters are then built from the merged histograms exactly as
+multivariate_make_normal builds them from the in-memory data.
+
+The data at iteration t is the original data pushed through the first t
+iterations. By default it is recomputed from the original blocks in every
+pass, so nothing but the current block is ever held, at a cost that grows
+with the number of iterations. Alternatively the gaussianized data can be
+spilled to a np.memmap on disk, which is then updated in place and read back
+block by block, so each pass only costs one read (and maybe one write) of the
+data.
+"""
+
+import logging
+import numpy as np
+from scipy.special import ndtri
+from scipy.stats import ortho_group
+from batched_interpolation import grid_searchsorted, interp_from_indices
+from multivariate_make_normal import (batched_histogram,
+                                      uniform_cdf_from_histogram)
+from rbig_model import RBIGModel
+from information_reduction import marginal_negentropy
+from householder_rotation import (random_householder_vectors,
+                                  default_num_reflections)
+from stream_rbig import iter_column_chunks, write_column_chunks
+
+logger = logging.getLogger('rbig')
+
+def rbig_out_of_core(data, num_iters, rotation_type, pdf_extension=0.1,
+                     pdf_resolution=1000, chunk_size=100000, spill_path=None,
+                     progress_report_interval=None, monotonic_method='laparra',
+                     convergence_tol=None, convergence_patience=3,
+                     num_reflections=None):
+  """
+  Rotation-based iterative gaussianization without holding the data in memory
+
+  Parameters
+  ----------
+  data : ndarray, np.memmap, callable, or iterable
+      The dataset, giving an iid sample in each column. Either a 2D array
+      (typically a np.memmap, so that only the current block is read into
+      memory), a callable that returns a fresh iterable of [DxM] chunks every
+      time it is called, or a re-iterable collection of such chunks. Every
+      iteration passes over the data several times, so a one-shot iterator or
+      generator must be wrapped in a callable that recreates it.
+  num_iters : int
+      The (maximum) number of steps to run the sequence of marginal
+      gaussianization and then rotation
+  rotation_type : str
+      One of {'PCA', 'random', 'householder'}. See rbig.py. The 'PCA'
+      rotation is found from the accumulated [DxD] second-moment matrix.
+  pdf_extension : float, optional
+      See rbig.py. Default 0.1
+  pdf_resolution : int, optional
+      See rbig.py. Default 1000
+  chunk_size : int, optional
+      The number of columns to process at a time when the data (or the spill
+      file) is an array. This bounds the working memory. Default 100000
+  spill_path : str, optional
+      If given, the gaussianized data is kept in a np.memmap at this path and
+      updated in place, rather than recomputed from the original data on
+      every pass. The file holds D*N float64 values.
+  progress_report_interval : int, optional
+      If given, log progress every this many iterations, at INFO level on the
+      'rbig' logger
+  monotonic_method : str, optional
+      See rbig.py. Default 'laparra'
+  convergence_tol : float, optional
+      See rbig.py. Default None, always run num_iters iterations
+  convergence_patience : int, optional
+      See rbig.py. Default 3
+  num_reflections : int, optional
+      See rbig.py. Default ceil(log2(D)) + 1
+
+  Returns
+  -------
+  g_data : np.memmap or None
+      The gaussianized data, held in the spill file, if spill_path was given.
+      Otherwise None; apply the returned model to the data (for instance with
+      stream_apply_rbig) to gaussianize it.
+  model : RBIGModel
+      The parameters of the learned transform. See rbig.py
+  """
+  if rotation_type not in ('PCA', 'random', 'householder'):
+    raise ValueError('Rotation type ' + rotation_type + ' not supported ' +
+                     'out of core')
+  read_chunks = _chunk_reader(data, chunk_size)
+  num_components, num_samples = _count_samples(data, read_chunks)
+  if rotation_type == 'householder':
+    if num_reflections is None:
+      num_reflections = default_num_reflections(num_components)
+  else:
+    num_reflections = None
+  model = RBIGModel.empty(num_iters, num_components, num_samples,
+                          pdf_extension, pdf_resolution, num_reflections)
+  num_bins = int(np.sqrt(num_samples))
+
+  g_data = None
+  if spill_path is not None:
+    g_data = np.memmap(spill_path, dtype=np.float64, mode='w+',
+                       shape=(num_components, num_samples))
+    write_column_chunks(read_chunks(), g_data)
+
+  def current_blocks(rbig_iter):
+    """The data going into iteration rbig_iter, a block at a time"""
+    if g_data is not None:
+      return iter_column_chunks(g_data, chunk_size)
+    return (_replay(model, rbig_iter, np.asarray(chunk, dtype=np.float64))
+            for chunk in read_chunks())
+
+  information_reduction = np.zeros(num_iters)
+  num_unimproved_iters = 0
+  num_completed_iters = 0
+  for rbig_iter in range(num_iters):
+    if progress_report_interval is not None:
+      if rbig_iter % progress_report_interval == 0:
+        logger.info('Completed %d iterations of RBIG', rbig_iter)
+
+    # Pass 1, the range of each component. The spill file still holds the
+    # unrotated output of the previous iteration, so rotate it on the way
+    data_min = np.full(num_components, np.inf)
+    data_max = np.full(num_components, -np.inf)
+    for block in current_blocks(rbig_iter):
+      if g_data is not None and rbig_iter > 0:
+        block[...] = model.rotate(rbig_iter - 1, block)
+      np.minimum(data_min, np.min(block, axis=1), out=data_min)
+      np.maximum(data_max, np.max(block, axis=1), out=data_max)
+
+    # Pass 2, merged histograms over fixed bins
+    bin_edges = np.linspace(data_min, data_max, num_bins + 1, axis=1)
+    counts = np.zeros((num_components, num_bins), dtype=np.intp)
+    data_sum = np.zeros(num_components)
+    data_sum_sq = np.zeros(num_components)
+    for block in current_blocks(rbig_iter):
+      counts += batched_histogram(block, bin_edges)
+      data_sum += np.sum(block, axis=1)
+      data_sum_sq += np.sum(block**2, axis=1)
+    params = uniform_cdf_from_histogram(counts, bin_edges, num_samples,
+                                        pdf_extension, pdf_resolution,
+                                        monotonic_method)
+    model.set_marginal_params(rbig_iter, params)
+    variance = data_sum_sq / num_samples - (data_sum / num_samples)**2
+    information_reduction[rbig_iter] = np.sum(marginal_negentropy(
+        params['empirical_pdf'], params['empirical_pdf_support'], variance,
+        num_samples))
+
+    # Pass 3, marginal gaussianization, accumulating the second moments
+    if g_data is not None or rotation_type == 'PCA':
+      second_moment = np.zeros((num_components, num_components))
+      for block in current_blocks(rbig_iter):
+        gaussianized = _gaussianize_marginals(model, rbig_iter, block)
+        if g_data is not None:
+          block[...] = gaussianized
+        if rotation_type == 'PCA':
+          second_moment += np.dot(gaussianized, gaussianized.T)
+
+    # Rotation
+    if rotation_type == 'PCA':
+      U, _, _ = np.linalg.svd(second_moment / num_samples, full_matrices=True)
+      model.set_rotation(rbig_iter, U.T)
+    elif rotation_type == 'random':
+      model.set_rotation(rbig_iter, ortho_group.rvs(num_components))
+    else:
+      model.set_rotation(rbig_iter, random_householder_vectors(
+          num_components, num_reflections))
+    num_completed_iters += 1
+
+    # Convergence
+    if convergence_tol is not None:
+      if information_reduction[rbig_iter] < convergence_tol:
+        num_unimproved_iters += 1
+      else:
+        num_unimproved_iters = 0
+      if num_unimproved_iters >= convergence_patience:
+        break
+
+  model.truncate(num_completed_iters)
+  model.diagnostics['information_reduction'] = \
+      information_reduction[:num_completed_iters]
+
+  if g_data is not None and num_completed_iters > 0:
+    # the last rotation has not been applied to the spilled data yet
+    for block in iter_column_chunks(g_data, chunk_size):
+      block[...] = model.rotate(num_completed_iters - 1, block)
+  if g_data is not None:
+    g_data.flush()
+
+  return g_data, model
+
+
+def _gaussianize_marginals(model, rbig_iter, data):
+  """Applies the marginal gaussianization of one iteration, as in fitting"""
+  support = model.uniform_cdf_support[rbig_iter]
+  uniform_data = interp_from_indices(data, support,
+                                     model.uniform_cdf[rbig_iter],
+                                     grid_searchsorted(support, data))
+  return ndtri(uniform_data)
+
+
+def _replay(model, num_iters, data):
+  """Pushes data through the first num_iters iterations of a partial model"""
+  for rbig_iter in range(num_iters):
+    data = model.rotate(rbig_iter, _gaussianize_marginals(model, rbig_iter,
+                                                          data))
+  return data
+
+
+def _chunk_reader(data, chunk_size):
+  """A callable that returns a fresh iterable over the chunks of data"""
+  if isinstance(data, np.ndarray):
+    return lambda: iter_column_chunks(data, chunk_size)
+  if callable(data):
+    return data
+  if iter(data) is data:
+    raise ValueError('data is a one-shot iterator but several passes are ' +
+                     'needed; pass a callable that recreates it instead')
+  return lambda: data
+
+
+def _count_samples(data, read_chunks):
+  """The number of components and samples in the data"""
+  if isinstance(data, np.ndarray):
+    return data.shape
+  num_components = None
+  num_samples = 0
+  for chunk in read_chunks():
+    num_components = chunk.shape[0]
+    num_samples += chunk.shape[1]
+  return num_components, num_samples
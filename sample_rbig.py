@@ -0,0 +1,42 @@
+"""
+Draws new samples from the distribution learned by RBIG
+"""
+
+from compiled_rbig import compile_rbig
+from tabulated_rbig import tabulate_rbig
+
+def sample_rbig(transform_params, num_samples, rng=None, batch_size=None,
+                n_jobs=None, executor=None, accuracy=None):
+  """
+  Generates synthetic data by inverting the RBIG transform on gaussian draws
+
+  Parameters
+  ----------
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. See invert_rbig.py
+  num_samples : int
+      The number of samples to draw
+  rng : int, np.random.Generator, or None, optional
+      Seed or generator for the gaussian draws, see np.random.default_rng.
+      A given seed gives the same samples whatever the batch_size.
+  batch_size : int, optional
+      The number of samples to generate at a time, which bounds the working
+      memory. Default all of them at once
+  n_jobs : int, optional
+      If greater than 1, split the marginal stages across this many threads.
+      See parallel_components.py
+  executor : concurrent.futures.Executor, optional
+      A (thread-based) executor to run the marginal stages on
+  accuracy : float, optional
+      If given, use lookup tables that precompose each marginal stage into a
+      single interpolation, accurate to this many standard deviations per
+      stage. See tabulated_rbig.py. Default None, the exact transform
+
+  Returns
+  -------
+  samples : ndarray
+      A 2D array giving a sample in each column
+  """
+  transform = (compile_rbig(transform_params) if accuracy is None else
+               tabulate_rbig(transform_params, accuracy))
+  return transform.sample(num_samples, rng, batch_size, n_jobs, executor)
@@ -0,0 +1,110 @@
+"""
+This file defines streaming versions of apply_rbig and invert_rbig
+
+apply_rbig and invert_rbig push the whole [DxN] dataset through every
+iteration at once, so their peak memory grows with N. The functions here
+instead take the data a block of columns at a time, either from an array
+(which may be a np.memmap, in which case only the current block is read into
+memory) or from any iterable of [DxM] chunks, and yield the transformed
+blocks. Peak memory is then set by the chunk size rather than by N.
+"""
+
+import numpy as np
+from compiled_rbig import compile_rbig
+
+def iter_column_chunks(data, chunk_size):
+  """
+  Yields consecutive blocks of columns of a 2D array
+
+  Parameters
+  ----------
+  data : ndarray or np.memmap
+      A 2D array giving an iid sample in each column
+  chunk_size : int
+      The (maximum) number of columns in each block
+  """
+  for base_idx in range(0, data.shape[1], chunk_size):
+    yield data[:, base_idx:base_idx+chunk_size]
+
+
+def stream_apply_rbig(data, transform_params, chunk_size=10000):
+  """
+  Applies a learned RBIG transform to data one block of columns at a time
+
+  Parameters
+  ----------
+  data : ndarray, np.memmap, or iterable
+      Either a 2D array giving an iid sample in each column or an iterable
+      of such 2D arrays (chunks). Arrays are split into blocks of chunk_size
+      columns, chunks from an iterable are transformed as they come.
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. See apply_rbig.py
+  chunk_size : int, optional
+      The number of columns to transform at a time when data is an array.
+
+  Yields
+  ------
+  rbig_transformed : ndarray
+      Each chunk, gaussianized using the RBIG transform
+  """
+  compiled_transform = compile_rbig(transform_params)
+  for chunk in _as_chunks(data, chunk_size):
+    yield compiled_transform.forward(np.asarray(chunk))
+
+
+def stream_invert_rbig(gaussian_data, transform_params, chunk_size=10000):
+  """
+  Inverts a learned RBIG transform one block of columns at a time
+
+  Parameters
+  ----------
+  gaussian_data : ndarray, np.memmap, or iterable
+      Either a 2D array of gaussianized data, one sample per column, or an
+      iterable of such 2D arrays (chunks)
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      Parameters of the forward transform. See invert_rbig.py
+  chunk_size : int, optional
+      The number of columns to invert at a time when gaussian_data is an array
+
+  Yields
+  ------
+  sampled_data : ndarray
+      Each chunk, mapped back into the input space
+  """
+  compiled_transform = compile_rbig(transform_params)
+  for chunk in _as_chunks(gaussian_data, chunk_size):
+    yield compiled_transform.inverse(np.asarray(chunk))
+
+
+def write_column_chunks(chunks, out):
+  """
+  Writes a stream of column blocks side by side into a preallocated array
+
+  Parameters
+  ----------
+  chunks : iterable
+      An iterable of 2D arrays, each with the same number of rows as out
+  out : ndarray or np.memmap
+      The 2D array to fill, for instance a np.memmap opened in 'w+' mode so
+      that the results never need to fit in memory at once
+
+  Returns
+  -------
+  out : ndarray or np.memmap
+      The filled array
+  """
+  base_idx = 0
+  for chunk in chunks:
+    out[:, base_idx:base_idx+chunk.shape[1]] = chunk
+    base_idx += chunk.shape[1]
+  if base_idx != out.shape[1]:
+    raise ValueError('Wrote ' + str(base_idx) + ' columns but out has ' +
+                     str(out.shape[1]))
+  return out
+
+
+def _as_chunks(data, chunk_size):
+  """Splits an array into column chunks, passes other iterables through"""
+  if isinstance(data, np.ndarray):
+    return iter_column_chunks(data, chunk_size)
+  return data
@@ -0,0 +1,266 @@
+"""
+This file defines a tabulated form of the RBIG transform
+
+The marginal stage of an iteration is the composition of two monotone maps,
+the piecewise-linear uniformization F and the gaussian quantile ndtri. The
+CompiledRBIG evaluates both for every entry: locating the CDF segment exactly,
+interpolating, and then calling ndtri. Its inverse calls ndtr and then needs a
+binary search, since the CDF values are not evenly spaced. Here each direction
+of the composition is instead tabulated once per component, on evenly spaced
+knots, so that applying it is a single interpolation whose segment is found by
+arithmetic:
+
+  forward    G(x) = ndtri(F(x)), tabulated on a refinement of the (evenly
+             spaced) support of the CDF. G is smooth between the CDF's knots,
+             so every table segment falls within one CDF segment.
+  inverse    H(g) = F^-1(ndtr(g)), tabulated on evenly spaced points of the
+             range of G
+
+The tables are refined until linear interpolation between their knots is
+within a chosen accuracy. A few segments never get there (those where G shoots
+off towards -inf or inf in the outermost tails, or that are still too curved at
+the chosen refinement) and are marked with a nan slope. Entries that land in
+one of them are recomputed exactly, so the accuracy target holds everywhere.
+The accuracy applies to each marginal stage on its own; through the full
+transform the errors of the stages can grow, mostly for the few samples in the
+far tails, where later stages are steepest.
+"""
+
+import numpy as np
+from scipy.special import ndtr, ndtri
+from batched_interpolation import take_rows
+from compiled_rbig import CompiledRBIG, _column_chunks
+from rbig_model import as_rbig_model
+from parallel_components import run_component_blocks
+
+TABULATION_FALLBACK_MASS = 1e-3
+#^ the refinement is increased until, on average over iterations and
+#^ components, at most this much probability falls in segments left exact
+
+class TabulatedRBIG(CompiledRBIG):
+  """
+  An RBIG transform whose marginal stages are precomposed lookup tables
+
+  A drop-in replacement for CompiledRBIG: forward, inverse and sample use the
+  tables, while marginal_uniformization and log_prob stay exact.
+
+  Parameters
+  ----------
+  model : RBIGModel
+      The learned RBIG transform
+  accuracy : float, optional
+      The largest allowed error of a tabulated marginal stage, in the
+      gaussianized (standard normal) units. For the forward stage that is the
+      difference from the exact gaussianized values. For the inverse it is
+      the difference between the inputs and what the exact forward stage
+      maps the results back to. Default 1e-4
+  max_refinement : int, optional
+      The largest number of table segments per CDF segment to try. The tables
+      take 4*I*D*(max_refinement*(P-1)+1) floats. Default 16
+
+  Attributes
+  ----------
+  refinement : int
+      The number of table segments per CDF segment that was chosen
+  fallback_mass : ndarray
+      A 3D array [2xIxD], the probability (under the learned marginals) of
+      landing in a segment that is computed exactly, in the forward and in the
+      inverse tables
+  """
+  def __init__(self, model, accuracy=1e-4, max_refinement=16):
+    super().__init__(model)
+    self.accuracy = accuracy
+    self.max_refinement = max_refinement
+
+    refinement = 1
+    while True:
+      tables = [self._tabulate_iteration(rbig_iter, refinement)
+                for rbig_iter in range(model.num_iters)]
+      fallback_mass = np.array([[table['forward_mass'] for table in tables],
+                                [table['inverse_mass'] for table in tables]])
+      if (refinement >= max_refinement or
+          np.mean(fallback_mass) <= TABULATION_FALLBACK_MASS):
+        break
+      refinement *= 2
+    self.refinement = refinement
+    self.fallback_mass = fallback_mass
+    for direction in ('forward', 'inverse'):
+      for part in ('start', 'step', 'knots', 'slopes'):
+        name = direction + '_' + part
+        setattr(self, name, np.array([table[name] for table in tables]))
+
+  def _tabulate_iteration(self, rbig_iter, refinement):
+    """
+    The tables of one iteration at one refinement
+
+    Returns
+    -------
+    tables : dictionary
+        For each of 'forward' and 'inverse', '<direction>_start' and
+        '<direction>_step' [D], the first knot and the spacing of the knots,
+        '<direction>_knots' [DxK], the map at the knots,
+        '<direction>_slopes' [Dx(K-1)], the change over each table segment
+        (nan for segments computed exactly), and '<direction>_mass' [D], the
+        probability of the segments computed exactly.
+    """
+    support = self.model.uniform_cdf_support[rbig_iter]
+    cdf = self.model.uniform_cdf[rbig_iter]
+    num_components = support.shape[0]
+    num_knots = refinement * (support.shape[1] - 1) + 1
+    tables = {}
+
+    def gaussianize(data):
+      return ndtri(self.marginal_uniformization(rbig_iter, data))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      # forward. G is concave, then convex, within a CDF segment, so linear
+      # interpolation is least accurate near the middle of each table segment
+      knots = np.linspace(support[:, 0], support[:, -1], num_knots, axis=1)
+      gaussian_knots = gaussianize(knots)
+      slopes = np.diff(gaussian_knots, axis=1)
+      error = np.abs(gaussianize(0.5 * (knots[:, :-1] + knots[:, 1:])) -
+                     (gaussian_knots[:, :-1] + 0.5 * slopes))
+      exact = ~(error <= self.accuracy) | ~np.isfinite(slopes)
+      slopes[exact] = np.nan
+      tables.update(forward_start=knots[:, 0],
+                    forward_step=knots[:, 1] - knots[:, 0],
+                    forward_knots=gaussian_knots, forward_slopes=slopes)
+      tables['forward_mass'] = np.sum(
+          np.diff(self.marginal_uniformization(rbig_iter, knots), axis=1),
+          axis=1, where=exact)
+
+      # inverse, over the range of G between its first and last finite knots,
+      # plus one segment on either side that catches anything beyond and is
+      # always computed exactly
+      lowest = gaussian_knots[:, 1]
+      highest = gaussian_knots[:, -2]
+      step = (highest - lowest) / (num_knots - 3)
+      gaussian_knots = lowest[:, None] + step[:, None] * np.arange(
+          -1, num_knots - 1)
+      knots = self.marginal_inverse_uniformization(rbig_iter,
+                                                   ndtr(gaussian_knots))
+      slopes = np.diff(knots, axis=1)
+      midpoints = gaussian_knots[:, :-1] + 0.5 * step[:, None]
+      error = np.abs(gaussianize(knots[:, :-1] + 0.5 * slopes) - midpoints)
+      # the inverse has a kink at every knot of the CDF, which may be
+      # anywhere within a table segment
+      kinks = ndtri(cdf[:, 1:-1])
+      kink_segment = np.clip(((kinks - gaussian_knots[:, :1]) /
+                              step[:, None]).astype(np.intp), 0,
+                             num_knots - 2)
+      kink_estimate = (take_rows(knots, kink_segment) +
+                       (kinks - take_rows(gaussian_knots, kink_segment)) /
+                       step[:, None] * take_rows(slopes, kink_segment))
+      # the error in x at the kink, times the steeper of G's one-sided slopes
+      cdf_slopes = self.uniform_cdf_slopes[rbig_iter]
+      kink_error = (np.abs(kink_estimate - support[:, 1:-1]) *
+                    np.maximum(cdf_slopes[:, :-1], cdf_slopes[:, 1:]) *
+                    np.sqrt(2 * np.pi) * np.exp(0.5 * kinks**2))
+      kink_error[~np.isfinite(kink_error)] = np.inf
+      np.maximum.at(error, (np.arange(num_components)[:, None], kink_segment),
+                    kink_error)
+      exact = ~(error <= self.accuracy) | ~np.isfinite(slopes)
+      exact[:, [0, -1]] = True
+      slopes[exact] = np.nan
+      tables.update(inverse_start=gaussian_knots[:, 0], inverse_step=step,
+                    inverse_knots=knots, inverse_slopes=slopes)
+      tables['inverse_mass'] = (
+          np.sum(np.diff(ndtr(gaussian_knots), axis=1), axis=1, where=exact) +
+          ndtr(gaussian_knots[:, 0]) + ndtr(-gaussian_knots[:, -1]))
+    return tables
+
+  def _marginal_gaussianization(self, rbig_iter, data, out, executor, n_jobs):
+    """G read off the forward table, written into out"""
+    def exact_transform(values, component):
+      # like rounding, the tables' small errors can push the most extreme
+      # samples just past the support of a CDF, so always clamp
+      uniform_data = self.marginal_uniformization(rbig_iter, values,
+                                                  component)
+      self._clamp_to_cdf_range(rbig_iter, uniform_data, component)
+      return ndtri(uniform_data)
+
+    self._apply_table(rbig_iter, 'forward', data, out, exact_transform,
+                      executor, n_jobs)
+
+  def _marginal_degaussianization(self, rbig_iter, data, out, executor,
+                                  n_jobs):
+    """H read off the inverse table, written into out"""
+    def exact_transform(values, component):
+      return self.marginal_inverse_uniformization(
+          rbig_iter, ndtr(values.astype(np.float64, copy=False)), component)
+
+    self._apply_table(rbig_iter, 'inverse', data, out, exact_transform,
+                      executor, n_jobs)
+
+  def _apply_table(self, rbig_iter, direction, data, out, exact_transform,
+                   executor, n_jobs):
+    """
+    Interpolates every row of data in its table, writing the result into out
+
+    Entries that land in a segment marked nan (or anywhere off the table) are
+    handed to exact_transform, which takes a [1xM] array of values and the
+    slice selecting their component.
+    """
+    start = getattr(self, direction + '_start')[rbig_iter][:, None]
+    inverse_step = 1 / getattr(self, direction + '_step')[rbig_iter][:, None]
+    knots = getattr(self, direction + '_knots')[rbig_iter]
+    slopes = getattr(self, direction + '_slopes')[rbig_iter]
+    last_segment = slopes.shape[1] - 1
+
+    def transform_block(rows):
+      for cols in _column_chunks(data.shape[1], rows, data.shape[0]):
+        position = (data[rows, cols] - start[rows]) * inverse_step[rows]
+        # fmax/fmin (unlike clip) send nans to a valid index. Anything off
+        # the table lands in an end segment, which is always computed exactly
+        np.fmin(np.fmax(position, 0, out=position), last_segment + 1,
+                out=position)
+        segment = position.astype(np.intp)
+        np.minimum(segment, last_segment, out=segment)
+        position -= segment
+        transformed = (take_rows(knots[rows], segment) +
+                       position * take_rows(slopes[rows], segment))
+        self._fix_exact_entries(transformed, data[rows, cols], rows,
+                                exact_transform)
+        out[rows, cols] = transformed
+
+    run_component_blocks(transform_block, data.shape[0], executor, n_jobs)
+
+  def _fix_exact_entries(self, result, data, rows, exact_transform):
+    """Recomputes the nan entries of result, row by row, exactly"""
+    exact_rows, exact_cols = np.nonzero(np.isnan(result))
+    if exact_rows.size == 0:
+      return
+    first_component = rows.indices(self.model.num_components)[0]
+    for row_idx in np.unique(exact_rows):
+      cols = exact_cols[exact_rows == row_idx]
+      component = first_component + row_idx
+      result[row_idx, cols] = exact_transform(
+          data[row_idx:row_idx+1, cols], slice(component, component + 1))[0]
+
+
+def tabulate_rbig(transform_params, accuracy=1e-4, max_refinement=16):
+  """
+  Returns the tabulated form of an RBIG transform
+
+  Like compile_rbig, the result is cached on the model, so asking again for
+  the same accuracy is free.
+
+  Parameters
+  ----------
+  transform_params : CompiledRBIG, RBIGModel, or dictionary
+      The learned transform in any of its representations
+  accuracy : float, optional
+      See TabulatedRBIG. Default 1e-4
+  max_refinement : int, optional
+      See TabulatedRBIG. Default 16
+  """
+  if isinstance(transform_params, CompiledRBIG):
+    model = transform_params.model
+  else:
+    model = as_rbig_model(transform_params)
+  tabulated = model._tabulated
+  if (tabulated is None or tabulated.accuracy != accuracy or
+      tabulated.max_refinement != max_refinement):
+    tabulated = TabulatedRBIG(model, accuracy, max_refinement)
+    model._tabulated = tabulated
+  return tabulated
@@ -0,0 +1,32 @@
+"""
+Tests of optimize_rbig_model
+"""
+
+import numpy as np
+from rbig import rbig
+from optimize_rbig import optimize_rbig_model
+from test_rbig import _skewed_data
+
+def test_gaussian_fit_collapses():
+  rng = np.random.RandomState(1)
+  data = rng.randn(3, 20000)
+  np.random.seed(0)
+  _, model = rbig(data, 30, 'PCA')
+
+  optimized, report = optimize_rbig_model(
+      model, validation_data=rng.randn(3, 20000))
+  # the histogram noise alone must not keep a stage
+  assert optimized.num_iters <= 3
+  assert report['validation_error'] <= report['error_bound']
+
+
+def test_non_gaussian_fit_keeps_its_early_stages():
+  data = _skewed_data(20000)
+  np.random.seed(0)
+  _, model = rbig(data, 30, 'PCA')
+
+  optimized, report = optimize_rbig_model(
+      model, validation_data=_skewed_data(20000, seed=1))
+  assert 3 < optimized.num_iters < 30
+  np.testing.assert_array_equal(report['kept_iterations'][:3], [0, 1, 2])
+  assert report['validation_error'] <= report['error_bound']
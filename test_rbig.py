@@ -0,0 +1,108 @@
+"""
+Tests of the rbig function
+"""
+
+import tracemalloc
+import numpy as np
+from rbig import rbig
+from apply_rbig import apply_rbig
+from invert_rbig import invert_rbig
+from estimate_prob_with_rbig import rbig_log_prob
+from compiled_rbig import compile_rbig
+from benchmark_rbig import make_benchmark_data
+
+def _skewed_data(num_samples, seed=0):
+  """Three dependent, non-gaussian components"""
+  rng = np.random.RandomState(seed)
+  data = rng.randn(3, num_samples)
+  data[1] = data[0]**2 + 0.3 * data[1]
+  data[2] = np.exp(data[2])
+  return data
+
+
+def test_subsample_fit_maps_all_training_data():
+  data = _skewed_data(100000)
+  np.random.seed(0)
+  g_data, model = rbig(data, 10, 'PCA', subsample_size=5000)
+
+  assert np.all(np.isfinite(g_data))
+  np.testing.assert_array_equal(apply_rbig(data, model), g_data)
+  log_prob, _ = rbig_log_prob(data, model)
+  assert np.all(np.isfinite(log_prob))
+
+
+def test_inplace_fit_allocates_one_scratch_array():
+  data = _skewed_data(500000)
+  np.random.seed(0)
+  _, model = rbig(data.copy(), 5, 'PCA')
+  tracemalloc.start()
+  try:
+    baseline, _ = tracemalloc.get_traced_memory()
+    np.random.seed(0)
+    g_data, inplace_model = rbig(data, 5, 'PCA', inplace=True)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  assert g_data is data
+  np.testing.assert_array_equal(inplace_model.uniform_cdf, model.uniform_cdf)
+  # the scratch array, plus the fixed-size temporaries of the marginal stages
+  assert peak - baseline < 1.5 * data.nbytes
+
+
+def test_float32_fit():
+  data = _skewed_data(20000)
+  np.random.seed(0)
+  g_data, model = rbig(data, 10, 'PCA', dtype=np.float32)
+
+  assert g_data.dtype == np.float32
+  np.testing.assert_array_equal(apply_rbig(data, model), g_data)
+  log_prob, transformed = rbig_log_prob(data, model)
+  assert np.all(np.isfinite(log_prob))
+  np.testing.assert_array_equal(transformed, g_data)
+  # float32 keeps about 7 digits, and each inverse stage amplifies the
+  # rounding a little in the tails (about 1e-4 at worst seen here)
+  np.testing.assert_allclose(invert_rbig(g_data, model), data, rtol=0,
+                             atol=5e-4)
+
+
+def test_float32_fit_tracks_float64_fit():
+  # only the first few iterations are compared: once the data is nearly
+  # gaussian its covariance is close to the identity, so the later PCA
+  # rotations are ill-determined and the two fits part ways
+  data = _skewed_data(20000)
+  np.random.seed(0)
+  g_data_32, _ = rbig(data, 3, 'PCA', dtype=np.float32)
+  np.random.seed(0)
+  g_data_64, _ = rbig(data, 3, 'PCA')
+  np.testing.assert_allclose(g_data_32, g_data_64, rtol=0, atol=1e-2)
+
+
+def test_float32_transforms_of_float64_model():
+  data = make_benchmark_data(10, 20000)
+  np.random.seed(0)
+  g_data, model = rbig(data, 10, 'PCA')
+
+  g_data_32 = apply_rbig(data, model, dtype=np.float32)
+  assert g_data_32.dtype == np.float32
+  error = np.abs(g_data_32 - g_data)
+  assert np.median(error) < 3e-7
+  assert np.percentile(error, 99.9) < 1.7e-5
+  # the few larger errors are samples far in the tails
+  assert np.mean(error > 1e-3) < 1e-4
+
+  sampled_data_32 = invert_rbig(g_data, model, dtype=np.float32)
+  assert sampled_data_32.dtype == np.float32
+  error = np.abs(sampled_data_32 - invert_rbig(g_data, model))
+  assert np.median(error) < 3e-7
+  assert np.percentile(error, 99.9) < 1.7e-5
+  assert np.max(error) < 1e-4
+
+
+def test_compiled_transform_accepts_lists():
+  data = _skewed_data(2000)
+  np.random.seed(0)
+  g_data, model = rbig(data, 5, 'PCA')
+  compiled = compile_rbig(model)
+  np.testing.assert_array_equal(compiled.forward(data.tolist()), g_data)
+  np.testing.assert_array_equal(compiled.inverse(g_data.tolist()),
+                                compiled.inverse(g_data))
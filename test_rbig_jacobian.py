@@ -0,0 +1,60 @@
+"""
+Tests of rbig_jacobian
+"""
+
+import numpy as np
+from rbig import rbig
+import rbig_jacobian as rbig_jacobian_module
+from rbig_jacobian import rbig_jacobian
+from estimate_prob_with_rbig import rbig_log_prob
+from test_rbig import _skewed_data
+
+def _fit(num_samples):
+  data = _skewed_data(num_samples)
+  np.random.seed(0)
+  _, model = rbig(data, 10, 'PCA')
+  return data, model
+
+
+def test_log_det_matches_log_prob():
+  data, model = _fit(20000)
+  jacobian, jacobian_rbig = rbig_jacobian(data, model)
+  log_prob, log_prob_rbig = rbig_log_prob(data, model)
+  np.testing.assert_array_equal(jacobian_rbig, log_prob_rbig)
+
+  _, log_det = np.linalg.slogdet(jacobian)
+  num_components = data.shape[0]
+  implied_log_det = (log_prob + 0.5 * np.sum(log_prob_rbig**2, axis=0) +
+                     0.5 * num_components * np.log(2 * np.pi))
+  difference = np.abs(log_det - implied_log_det)
+  assert np.median(difference) < 1e-13
+  # the determinant of an ill-conditioned jacobian (far in the tails) is only
+  # accurate to about the float spacing times its condition number
+  np.testing.assert_array_less(
+      difference, 1e-12 + 1e-13 * np.linalg.cond(jacobian))
+
+
+def test_threads_share_the_samples_and_the_budget(monkeypatch):
+  data, model = _fit(2000)
+  jacobian, data_rbig = rbig_jacobian(data, model)
+
+  chunk_sizes = []
+  jacobian_chunk = rbig_jacobian_module._jacobian_chunk
+  def counting_jacobian_chunk(data, compiled_transform):
+    chunk_sizes.append(data.shape[1])
+    return jacobian_chunk(data, compiled_transform)
+  monkeypatch.setattr(rbig_jacobian_module, '_jacobian_chunk',
+                      counting_jacobian_chunk)
+
+  # n_jobs stays in the third position
+  threaded_jacobian, threaded_rbig = rbig_jacobian(data, model, 2)
+  assert chunk_sizes == [1000, 1000]
+  np.testing.assert_array_equal(threaded_jacobian, jacobian)
+  np.testing.assert_array_equal(threaded_rbig, data_rbig)
+
+  # 3 [nxDxD] float64 arrays per chunk, within half of the budget each
+  chunk_sizes.clear()
+  chunked_jacobian, _ = rbig_jacobian(data, model, 2, max_memory_bytes=20000)
+  assert max(chunk_sizes) == 20000 // 2 // (3 * 3 * 3 * 8)
+  assert sum(chunk_sizes) == data.shape[1]
+  np.testing.assert_array_equal(chunked_jacobian, jacobian)
@@ -0,0 +1,25 @@
+"""
+Tests of rbig_out_of_core
+"""
+
+import numpy as np
+from rbig_out_of_core import rbig_out_of_core
+from apply_rbig import apply_rbig
+from test_rbig import _skewed_data
+
+def test_spilled_fit_without_iterations(tmp_path):
+  data = _skewed_data(1000)
+  g_data, model = rbig_out_of_core(data, 0, 'PCA', chunk_size=300,
+                                   spill_path=str(tmp_path / 'spill.dat'))
+  assert model.num_iters == 0
+  np.testing.assert_array_equal(g_data, data)
+
+
+def test_spilled_data_matches_the_model(tmp_path):
+  data = _skewed_data(1000)
+  np.random.seed(0)
+  g_data, model = rbig_out_of_core(data, 3, 'PCA', chunk_size=300,
+                                   spill_path=str(tmp_path / 'spill.dat'))
+  assert model.num_iters == 3
+  np.testing.assert_allclose(apply_rbig(data, model), g_data, rtol=0,
+                             atol=1e-10)
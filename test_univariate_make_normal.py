@@ -0,0 +1,57 @@
+"""
+Tests of the monotonic corrections in univariate_make_normal.py
+"""
+
+import numpy as np
+import pytest
+from univariate_make_normal import (make_cdf_monotonic,
+                                    make_cdf_monotonic_vectorized)
+
+def _histogram_cdf(samples, num_bins, precision):
+  """A cdf like those rbig builds, resampled from a cumulative histogram"""
+  counts, bin_edges = np.histogram(samples, num_bins)
+  cdf = np.hstack((0, np.cumsum(counts) / len(samples)))
+  support = np.linspace(bin_edges[0], bin_edges[-1], precision)
+  return np.interp(support, bin_edges, cdf)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_matches_laparra_on_histogram_cdfs(seed):
+  rng = np.random.RandomState(seed)
+  # heavy tails leave many empty bins, so the cdfs have long plateaus
+  samples = rng.standard_cauchy(2000)
+  cdf = _histogram_cdf(samples, int(np.sqrt(len(samples))), 1000)
+
+  laparra = make_cdf_monotonic(cdf, 'laparra')
+  vectorized = make_cdf_monotonic_vectorized(cdf)
+  # the two differ only by the ramp of 1e-14 per point
+  np.testing.assert_allclose(vectorized, laparra, rtol=0,
+                             atol=1e-14 * len(cdf))
+  np.testing.assert_array_equal(make_cdf_monotonic(cdf, 'vectorized'),
+                                vectorized)
+
+
+def test_vectorized_is_strictly_increasing_over_flat_and_decreasing_runs():
+  cdf = np.array([0., 0., 0., 0.1, 0.3, 0.3, 0.3, 0.25, 0.2, 0.5, 0.9, 0.85,
+                  1., 1., 1.])
+  corrected = make_cdf_monotonic_vectorized(cdf)
+  assert np.all(np.diff(corrected) > 0)
+  # nothing moves by more than the ramp, beyond lifting the decreases
+  np.testing.assert_allclose(corrected, np.maximum.accumulate(cdf), rtol=0,
+                             atol=1e-14 * len(cdf))
+
+
+def test_vectorized_corrects_each_row_independently():
+  rng = np.random.RandomState(0)
+  cdfs = np.array([_histogram_cdf(rng.standard_cauchy(500), 22, 100)
+                   for _ in range(4)])
+  corrected = make_cdf_monotonic_vectorized(cdfs)
+  for row, corrected_row in zip(cdfs, corrected):
+    np.testing.assert_array_equal(make_cdf_monotonic_vectorized(row),
+                                  corrected_row)
+  assert np.all(np.diff(corrected, axis=1) > 0)
+
+
+def test_unknown_method_raises():
+  with pytest.raises(ValueError):
+    make_cdf_monotonic(np.linspace(0, 1, 5), 'sorted')
@@ -6,7 +6,8 @@ import numpy as np
 from scipy.interpolate import interp1d
 from scipy.stats import norm
 
-def univariate_make_normal(uni_data, extension, precision):
+def univariate_make_normal(uni_data, extension, precision,
+                           monotonic_method='laparra'):
   """
   Takes univariate data and transforms it to have approximately normal dist
 
@@ -22,6 +23,9 @@ def univariate_make_normal(uni_data, extension, precision):
       Extend the marginal PDF support by this amount.
   precision : int
       The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDF to be strictly increasing. See
+      make_cdf_monotonic
 
   Returns
   -------
@@ -30,11 +34,13 @@ def univariate_make_normal(uni_data, extension, precision):
   params : dictionary
       parameters of the transform. We save these so we can invert them later
   """
-  data_uniform, params = univariate_make_uniform(uni_data, extension, precision)
+  data_uniform, params = univariate_make_uniform(uni_data, extension, precision,
+                                                 monotonic_method)
   return norm.ppf(data_uniform), params
 
 
-def univariate_make_uniform(uni_data, extension, precision):
+def univariate_make_uniform(uni_data, extension, precision,
+                            monotonic_method='laparra'):
   """
   Takes univariate data and transforms it to have approximately uniform dist
 
@@ -46,6 +52,9 @@ def univariate_make_uniform(uni_data, extension, precision):
       Extend the marginal PDF support by this amount. Default 0.1
   precision : int
       The number of points in the marginal PDF
+  monotonic_method : str, optional
+      How to force the learned CDF to be strictly increasing. See
+      make_cdf_monotonic
 
   Returns
   -------
@@ -61,7 +70,7 @@ def univariate_make_uniform(uni_data, extension, precision):
   # not sure exactly what we're doing here, but at a high level we're
   # constructing bins for the histogram
   bin_edges = np.linspace(np.min(uni_data), np.max(uni_data),
-                           np.sqrt(n_samps) + 1)
+                           int(np.sqrt(n_samps)) + 1)
   bin_centers = np.mean(np.vstack((bin_edges[0:-1], bin_edges[1:])), axis=0)
 
   counts, _ = np.histogram(uni_data, bin_edges)
@@ -84,7 +93,7 @@ def univariate_make_uniform(uni_data, extension, precision):
   extended_cdf = np.hstack((0.0, 1.0 / n_samps, cdf, 1.0))
   new_support = np.linspace(new_bin_edges[0], new_bin_edges[-1], precision)
   learned_cdf = interp1d(new_bin_edges, extended_cdf)
-  uniform_cdf = make_cdf_monotonic(learned_cdf(new_support))
+  uniform_cdf = make_cdf_monotonic(learned_cdf(new_support), monotonic_method)
   #^ linear interpolation
   uniform_cdf /= np.max(uniform_cdf)
   uni_uniform_data = interp1d(new_support, uniform_cdf)(uni_data)
@@ -94,7 +103,7 @@ def univariate_make_uniform(uni_data, extension, precision):
                             'uniform_cdf_support': new_support,
                             'uniform_cdf': uniform_cdf}
 
-def make_cdf_monotonic(cdf):
+def make_cdf_monotonic(cdf, method='laparra'):
   """
   Take a cdf and just sequentially readjust values to force monotonicity
 
@@ -105,7 +114,17 @@ def make_cdf_monotonic(cdf):
   ----------
   cdf : ndarray
       The values of the cdf in order (1d)
+  method : str, optional
+      One of {'laparra', 'vectorized'}. 'laparra' is the sequential correction
+      from the original implementation. 'vectorized' is the much faster
+      make_cdf_monotonic_vectorized, which agrees with it to within ~1e-11 on
+      cdfs taking values in [0, 1]. Default 'laparra'.
   """
+  if method == 'vectorized':
+    return make_cdf_monotonic_vectorized(cdf)
+  elif method != 'laparra':
+    raise ValueError('Monotonic method ' + method + ' not recognized')
+
   # laparra's version
   corrected_cdf = cdf.copy()
   for i in range(1, len(corrected_cdf)):
@@ -119,6 +138,23 @@ def make_cdf_monotonic(cdf):
                             10**(np.log10(abs(corrected_cdf[i-1]))))
   return corrected_cdf
 
-  # my version
-  # I think actually i need to make sure i is strictly increasing....
-  # return np.maximum.accumulate(cdf)
+
+def make_cdf_monotonic_vectorized(cdf):
+  """
+  Forces a cdf to be strictly increasing with a couple of array operations
+
+  A running maximum removes any decreases, and adding a ramp of 1e-14 per
+  point then turns the remaining plateaus into strict increases. For values in
+  [0, 1] the ramp step is many times the float spacing, so the result is
+  strictly increasing, which the inverse interpolation in
+  univariate_invert_uniformization relies on. Points move by at most
+  1e-14 * len(cdf).
+
+  Parameters
+  ----------
+  cdf : ndarray
+      The values of the cdf in order along the last axis. Any leading axes
+      index independent cdfs, which are all corrected at once.
+  """
+  ramp = 1e-14 * np.arange(cdf.shape[-1])
+  return np.maximum.accumulate(cdf, axis=-1) + ramp